@@ -8,26 +8,21 @@ import matplotlib.pyplot as plt
 import numpy as np
 
 from strategy_mean_momentum import mean_momentum_strategy
+from indicator_store import IndicatorStore
+from connection import historical_request_window
+from signal_kernels import SellReason
+from metrics import MetricsAccumulator
 
 pd.options.mode.chained_assignment = None
 
 
-class Backtester:
-
-
-    def __init__(self, strategy_object, start_date, end_date, initial_capital=100000.0, commission=2.50,
-                 trail_percentage=0.10):
+class Sleeve:
+    def __init__(self, name, strategy_object, weight=1.0):
+        self.name = name
         self.strategy = strategy_object
-        self.start_date = start_date
-        self.end_date = end_date
-        self.initial_capital = initial_capital
-        self.commission = commission
-        self.trail_percentage = trail_percentage
-
-        self.active_capital_base = self.initial_capital * 0.5
-        self.passive_capital_base = self.initial_capital * 0.5
-        self.cash = self.active_capital_base  # Cash for the active strategy
-        self.qqq_shares = 0
+        self.weight = weight
+        self.capital_base = 0.0
+        self.cash = 0.0
         self.positions = pd.DataFrame({
             'symbol': pd.Series(dtype='str'),
             'quantity': pd.Series(dtype='int'),
@@ -44,11 +39,67 @@ class Backtester:
             'quantity': pd.Series(dtype='int'),
             'pnl': pd.Series(dtype='float')
         })
+        self.equity_curve = []
+        self.metrics = MetricsAccumulator()
+        # the strategy's tickers and their indicator store columns (-1 when missing), set by run()
+        self.tickers = None
+        self.columns = None
+
+
+class Backtester:
+
+
+    def __init__(self, strategy_object=None, start_date=None, end_date=None, initial_capital=100000.0, commission=2.50,
+                 trail_percentage=0.10, sleeves=None, passive_weight=0.5, connection=None, stop_mode="close",
+                 fast_signals=False, early_stop=None, quiet=False, selection="ordered", top_k=5,
+                 indicator_dtype=np.float64):
+        # sleeves: list of (name, strategy_object, weight) run side by side on one data pass.
+        # without it the single strategy_object gets the whole active half, as before
+        if sleeves is None:
+            sleeves = [("active", strategy_object, 1.0)]
+        self.sleeves = [Sleeve(name, strategy, weight) for name, strategy, weight in sleeves]
+        self.strategy = self.sleeves[0].strategy
+        self.start_date = start_date
+        self.end_date = end_date
+        self.initial_capital = initial_capital
+        self.commission = commission
+        self.trail_percentage = trail_percentage
+        # "close": the stop is ratcheted and checked on daily closes, like the polling loop does.
+        # "trail_order": models an IB TRAIL order resting at the broker, ratcheted on the day's high
+        # and filled intraday at the stop (or at the open when the price gaps through it)
+        self.stop_mode = stop_mode
+        self.fast_signals = fast_signals  # evaluate each sleeve's rules with the signal_kernels batch calls
+        # early_stop(metrics) -> bool is called after every bar with the running metrics of the
+        # whole portfolio, returning True ends the simulation there (e.g. to drop hopeless sweep runs)
+        self.early_stop = early_stop
+        # "ordered": buy signals are taken in ticker list order while cash lasts.
+        # "ranked": each day all candidates are scored together and only the top_k best are bought
+        self.selection = selection
+        self.top_k = top_k
+        # prices, indicators and regime for the whole run, built once in run(). float32 indicators
+        # halve their memory for large universes (signals may then differ in the last digits)
+        self.indicator_dtype = indicator_dtype
+        self.indicators = None
+        self.metrics = MetricsAccumulator()
+        self.nasdaq_metrics = MetricsAccumulator()
+        self.connection = connection  # a connected Connection makes IB the data source instead of yfinance
+
+        self.passive_weight = passive_weight
+        self.active_capital_base = self.initial_capital * (1 - passive_weight)
+        self.passive_capital_base = self.initial_capital * passive_weight
+        total_weight = sum(sleeve.weight for sleeve in self.sleeves)
+        for sleeve in self.sleeves:
+            sleeve.capital_base = self.active_capital_base * sleeve.weight / total_weight
+            sleeve.cash = sleeve.capital_base
+        self.qqq_shares = 0
 
         self.all_ticker_data = {}
         self.all_benchmark_data = {}
+        self.quiet = quiet  # no log file, console output or plot, for sweeps
         self.logger = self._setup_logger()
-        self.tickers = self.strategy.tickers
+        self.tickers = []
+        for sleeve in self.sleeves:
+            self.tickers += [ticker for ticker in sleeve.strategy.tickers if ticker not in self.tickers]
 
     def _setup_logger(self):
         run_timestamp = datetime.now().strftime('%Y-%m-%d_%H-%M-%S')
@@ -56,6 +107,9 @@ class Backtester:
         logger = logging.getLogger('NewBacktesterLogger')
         logger.setLevel(logging.INFO)
         if logger.hasHandlers(): logger.handlers.clear()
+        if self.quiet:
+            logger.addHandler(logging.NullHandler())
+            return logger
         file_handler = logging.FileHandler(log_filename)
         file_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
         logger.addHandler(file_handler)
@@ -67,67 +121,213 @@ class Backtester:
     def _download_full_historical_data(self):
         tickers_to_download = self.tickers + ['QQQ', '^NDX', '^GSPC']
         self.logger.info(f"Downloading all historical data for {len(tickers_to_download)} symbols...")
-        all_data = yf.download(tickers_to_download, start=self.start_date, end=self.end_date)
+        if self.connection is not None:
+            end_date_time, duration = historical_request_window(self.start_date, self.end_date)
+            frames = self.connection.request_historical_bars(tickers_to_download, duration=duration,
+                                                             end_date_time=end_date_time)
+            frames = {ticker: df.loc[self.start_date:] for ticker, df in frames.items()}
+        else:
+            all_data = yf.download(tickers_to_download, start=self.start_date, end=self.end_date)
+            frames = {ticker: all_data.xs(ticker, level=1, axis=1) for ticker in tickers_to_download
+                      if ('Close', ticker) in all_data.columns}
 
         for ticker in self.tickers:
-            if ('Close', ticker) in all_data.columns:
-                self.all_ticker_data[ticker] = all_data.xs(ticker, level=1, axis=1).dropna()
+            if ticker in frames:
+                self.all_ticker_data[ticker] = frames[ticker].dropna()
 
-        self.all_benchmark_data['QQQ'] = all_data.xs('QQQ', level=1, axis=1).dropna()
-        self.all_benchmark_data['^NDX'] = all_data.xs('^NDX', level=1, axis=1).dropna()
-        self.all_benchmark_data['^GSPC'] = all_data.xs('^GSPC', level=1, axis=1).dropna()
+        self.all_benchmark_data['QQQ'] = frames['QQQ'].dropna()
+        self.all_benchmark_data['^NDX'] = frames['^NDX'].dropna()
+        self.all_benchmark_data['^GSPC'] = frames['^GSPC'].dropna()
         self.logger.info("Full data download complete.")
 
     def _update_strategy_for_day(self, today):
-        nasdaq_slice = self.all_benchmark_data['^NDX'].loc[:today]
-        if not nasdaq_slice.empty:
-            self.strategy.nasdaq100 = nasdaq_slice
-        for ticker in self.tickers:
-            if ticker in self.all_ticker_data:
-                data_slice = self.all_ticker_data[ticker].loc[:today]
-                if not data_slice.empty:
-                    self.strategy.tickers_data[ticker] = data_slice
-                    self.strategy.calculate_indicators(ticker, data_slice)
+        # every sleeve reads the same store, which now ends on today
+        self.indicators.set_date(today)
 
-    def buy(self, ticker: str, price: float, date):
+    def buy(self, sleeve: Sleeve, ticker: str, price: float, date):
         investment_amount = 5000
-        if self.cash * 0.1 > 5000:
-            investment_amount = self.cash * 0.1
-        if investment_amount >= self.cash:
-            investment_amount = self.cash * 0.10
+        if sleeve.cash * 0.1 > 5000:
+            investment_amount = sleeve.cash * 0.1
+        if investment_amount >= sleeve.cash:
+            investment_amount = sleeve.cash * 0.10
         quantity = int(investment_amount / price)
         cost = (quantity * price) + self.commission
-        if self.cash > cost and quantity > 0:
-            self.cash -= cost
+        if sleeve.cash > cost and quantity > 0:
+            sleeve.cash -= cost
             initial_stop_loss = price * (1 - self.trail_percentage)
             new_position = pd.DataFrame(
                 [{'symbol': ticker, 'quantity': quantity, 'buy_price': price,
                   'buy_date': date, 'stop_loss_price': initial_stop_loss}])
-            self.positions = pd.concat([self.positions, new_position], ignore_index=True)
-            self.logger.info(f"{date.date()} - BUY: {quantity} of {ticker} at ${price}")
+            sleeve.positions = pd.concat([sleeve.positions, new_position], ignore_index=True)
+            self.logger.info(f"{date.date()} - [{sleeve.name}] BUY: {quantity} of {ticker} at ${price}")
 
-    def sell(self, ticker: str, current_price: float, date, position_index, reason: str):
-        pos_data = self.positions.loc[position_index]
+    def sell(self, sleeve: Sleeve, ticker: str, current_price: float, date, position_index, reason: str):
+        pos_data = sleeve.positions.loc[position_index]
         revenue = (pos_data['quantity'] * current_price) - self.commission
         pnl = (current_price - pos_data['buy_price']) * pos_data['quantity'] - self.commission
-        self.cash += revenue
+        sleeve.cash += revenue
+        sleeve.metrics.add_trade(ticker, pnl)
+        self.metrics.add_trade(ticker, pnl)
         new_trade = pd.DataFrame([{'symbol': ticker, 'buy_date': pos_data['buy_date'], 'sell_date': date,
                                    'buy_price': pos_data['buy_price'], 'sell_price': current_price,
                                    'quantity': pos_data['quantity'], 'pnl': pnl}])
-        self.trades_log = pd.concat([self.trades_log, new_trade], ignore_index=True)
-        self.positions = self.positions.drop(position_index).reset_index(drop=True)
+        sleeve.trades_log = pd.concat([sleeve.trades_log, new_trade], ignore_index=True)
+        sleeve.positions = sleeve.positions.drop(position_index).reset_index(drop=True)
         self.logger.info(
-            f"{date.date()} - SELL ({reason}): {pos_data['quantity']} of {ticker} at ${current_price:.2f} | P&L: ${pnl:.2f}")
+            f"{date.date()} - [{sleeve.name}] SELL ({reason}): {pos_data['quantity']} of {ticker} at ${current_price:.2f} | P&L: ${pnl:.2f}")
+
+    def _run_trailing_stop_orders(self, sleeve: Sleeve, today):
+        triggered = []
+        for index, pos in sleeve.positions.iterrows():
+            try:
+                bar_open = self.indicators.price(pos['symbol'], 'Open')
+            except KeyError:
+                continue
+            if bar_open <= pos['stop_loss_price']:
+                triggered.append((index, pos['symbol'], bar_open))
+            elif self.indicators.price(pos['symbol'], 'Low') <= pos['stop_loss_price']:
+                triggered.append((index, pos['symbol'], pos['stop_loss_price']))
+            else:
+                potential_new_stop = self.indicators.price(pos['symbol'], 'High') * (1 - self.trail_percentage)
+                if potential_new_stop > pos['stop_loss_price']:
+                    sleeve.positions.loc[index, 'stop_loss_price'] = potential_new_stop
+        # sell() reindexes the positions frame, so close from the back
+        for index, symbol, fill_price in reversed(triggered):
+            self.sell(sleeve, symbol, fill_price, today, index, reason="Trailing Stop (broker)")
+
+    def _mark_to_market(self, sleeve: Sleeve, today):
+        active_market_value = 0.0
+        for index, pos in sleeve.positions.iterrows():
+            try:
+                current_price = self.indicators.price(pos['symbol'])
+                potential_new_stop = current_price * (1 - self.trail_percentage)
+                if self.stop_mode == "close" and potential_new_stop > pos['stop_loss_price']:
+                    sleeve.positions.loc[index, 'stop_loss_price'] = potential_new_stop
+                active_market_value += pos['quantity'] * current_price
+            except KeyError:
+                active_market_value += pos['quantity'] * pos['buy_price']
+        return active_market_value
+
+    def _batch_signals(self, sleeve: Sleeve, today):
+        # decisions don't depend on cash, so all of them can be made up front in two kernel calls
+        prices = {}
+        for ticker in sleeve.strategy.tickers:
+            try:
+                prices[ticker] = self.indicators.price(ticker)
+            except KeyError:
+                continue
+        bullish = sleeve.strategy.is_bullish()
+        sell_decisions = self._batch_sell_signals(sleeve, today, prices, bullish)
+        candidates = [ticker for ticker in prices if ticker not in sell_decisions]
+        buys = sleeve.strategy.get_buy_signals(candidates, [prices[ticker] for ticker in candidates], bullish)
+        decisions = dict(zip(candidates, buys))
+        decisions.update(sell_decisions)
+        return decisions, prices
+
+    def _batch_sell_signals(self, sleeve: Sleeve, today, prices, bullish):
+        # sell decision for every held ticker in prices, judged on its first position
+        held = {}
+        for pos in sleeve.positions.itertuples():
+            if pos.symbol in prices and pos.symbol not in held:
+                held[pos.symbol] = pos
+        if not held:
+            return {}
+        sells = sleeve.strategy.get_sell_signals(list(held), [prices[ticker] for ticker in held],
+                                                 [{'stop_loss_price': pos.stop_loss_price} for pos in held.values()],
+                                                 [(today - pos.buy_date).days for pos in held.values()], bullish)
+        return dict(zip(held, sells != SellReason.HOLD))
+
+    def _check_exits(self, sleeve: Sleeve, ticker, position_rows, current_price, today, decisions):
+        for index, pos in position_rows.iterrows():
+            if self.stop_mode == "close" and current_price <= pos['stop_loss_price']:
+                self.sell(sleeve, ticker, current_price, today, index, reason="Trailing Stop")
+                break
+            days_held = (today - pos['buy_date']).days
+            if decisions is not None:
+                sell_signal = decisions[ticker]
+            else:
+                sell_signal = sleeve.strategy.get_sell_signal(ticker, current_price, pos.to_dict(), days_held)
+            if sell_signal:
+                self.sell(sleeve, ticker, current_price, today, index, reason="Strategy Signal")
+                break
+
+    def _evaluate_sleeve(self, sleeve: Sleeve, today):
+        if self.selection == "ranked":
+            self._evaluate_ranked(sleeve, today)
+            return
+        decisions, prices = self._batch_signals(sleeve, today) if self.fast_signals else (None, None)
+        for ticker in sleeve.strategy.tickers:
+            if prices is not None:
+                if ticker not in prices:
+                    continue
+                current_price = prices[ticker]
+            else:
+                try:
+                    current_price = self.indicators.price(ticker)
+                except KeyError:
+                    continue
+            position_rows = sleeve.positions[sleeve.positions['symbol'] == ticker]
+            if not position_rows.empty:
+                self._check_exits(sleeve, ticker, position_rows, current_price, today, decisions)
+            else:
+                if decisions[ticker] if decisions is not None else sleeve.strategy.get_buy_signal(ticker, current_price):
+                    self.buy(sleeve, ticker, current_price, today)
+
+    def _evaluate_ranked(self, sleeve: Sleeve, today):
+        # exits run per held ticker. the candidates are everything else with a bar today, read as
+        # one row of the store and ranked as arrays, so the universe is never looped over in Python
+        store = self.indicators
+        held_symbols = set(sleeve.positions['symbol'])
+        prices = {}
+        for ticker in sleeve.strategy.tickers:
+            if ticker in held_symbols:
+                try:
+                    prices[ticker] = store.price(ticker)
+                except KeyError:
+                    continue
+        decisions = None
+        if self.fast_signals:
+            decisions = self._batch_sell_signals(sleeve, today, prices, sleeve.strategy.is_bullish())
+        for ticker, current_price in prices.items():
+            position_rows = sleeve.positions[sleeve.positions['symbol'] == ticker]
+            self._check_exits(sleeve, ticker, position_rows, current_price, today, decisions)
+
+        known = sleeve.columns >= 0
+        if not store.on_date or not known.any():
+            return
+        closes = np.full(sleeve.columns.shape[0], np.nan)
+        closes[known] = store.arrays['Close'][store.cursor, sleeve.columns[known]]
+        held_columns = [store.column[ticker] for ticker in held_symbols if ticker in store.column]
+        candidates = ~np.isnan(closes) & ~np.isin(sleeve.columns, held_columns)
+        if not candidates.any():
+            return
+        for ticker in sleeve.strategy.rank_buy_candidates(sleeve.tickers[candidates], closes[candidates],
+                                                          self.top_k, columns=sleeve.columns[candidates]):
+            self.buy(sleeve, ticker, store.price(ticker), today)
 
     def run(self):
-        self._download_full_historical_data()
+        if not self.all_benchmark_data:  # data may have been loaded up front, e.g. shared across sweep runs
+            self._download_full_historical_data()
         master_timeline = self.all_benchmark_data['^NDX'].index
+        if self.indicators is None:  # a store may be passed in too, sweeps reuse one across runs
+            self.indicators = IndicatorStore(self.all_ticker_data, self.all_benchmark_data['^NDX'],
+                                             dtype=self.indicator_dtype)
+        for sleeve in self.sleeves:
+            sleeve.strategy.use_indicators(self.indicators)
+            sleeve.tickers = np.array(sleeve.strategy.tickers, dtype=object)
+            sleeve.columns = np.array([self.indicators.column.get(ticker, -1) for ticker in sleeve.strategy.tickers],
+                                      dtype=np.int64)
+        self.logger.info(self.indicators.memory_summary())
 
         first_day_price = self.all_benchmark_data['QQQ']['Close'].iloc[0]
         self.qqq_shares = self.passive_capital_base / first_day_price
         self.logger.info(
-            f"Allocating 50% of capital (${self.passive_capital_base:,.2f}) to passive QQQ holding ({self.qqq_shares:.2f} shares).")
-        self.logger.info(f"Remaining 50% (${self.cash:,.2f}) allocated to active strategy.")
+            f"Allocating ${self.passive_capital_base:,.2f} to passive QQQ holding ({self.qqq_shares:.2f} shares).")
+        self.logger.info(f"Trailing stop: {self.trail_percentage:.0%} ({self.stop_mode}), selection: {self.selection}"
+                         + (f" (top {self.top_k} per day)" if self.selection == "ranked" else ""))
+        for sleeve in self.sleeves:
+            self.logger.info(f"Sleeve '{sleeve.name}': ${sleeve.cash:,.2f} allocated to active strategy "
+                             f"({len(sleeve.strategy.tickers)} tickers, mode={sleeve.strategy.mode}).")
 
         equity_curve = []
         self.logger.info(f"--- Starting Simulation ({master_timeline[0].date()} to {master_timeline[-1].date()}) ---")
@@ -135,75 +335,56 @@ class Backtester:
         for today in master_timeline:
             self._update_strategy_for_day(today)
 
-            active_market_value = 0.0
-            for index, pos in self.positions.iterrows():
-                try:
-                    current_price = self.all_ticker_data[pos['symbol']].loc[today]['Close']
-                    potential_new_stop = current_price * (1 - self.trail_percentage)
-                    if potential_new_stop > pos['stop_loss_price']:
-                        self.positions.loc[index, 'stop_loss_price'] = potential_new_stop
-                    active_market_value += pos['quantity'] * current_price
-                except KeyError:
-                    active_market_value += pos['quantity'] * pos['buy_price']
-
             qqq_price_today = self.all_benchmark_data['QQQ']['Close'].loc[today]
             passive_value = self.qqq_shares * qqq_price_today
-            total_portfolio_value = self.cash + active_market_value + passive_value
+            total_portfolio_value = passive_value
+            for sleeve in self.sleeves:
+                if self.stop_mode == "trail_order":
+                    self._run_trailing_stop_orders(sleeve, today)
+                sleeve_value = sleeve.cash + self._mark_to_market(sleeve, today)
+                sleeve.equity_curve.append({'date': today, 'value': sleeve_value})
+                sleeve.metrics.update(sleeve_value)
+                total_portfolio_value += sleeve_value
             equity_curve.append({'date': today, 'value': total_portfolio_value})
+            self.metrics.update(total_portfolio_value)
+            self.nasdaq_metrics.update(self.all_benchmark_data['^NDX']['Close'].loc[today])
 
-            for ticker in self.tickers:
-                try:
-                    current_price = self.all_ticker_data[ticker].loc[today]['Close']
-                except KeyError:
-                    continue
-                position_rows = self.positions[self.positions['symbol'] == ticker]
-                if not position_rows.empty:
-                    for index, pos in position_rows.iterrows():
-                        if current_price <= pos['stop_loss_price']:
-                            self.sell(ticker, current_price, today, index, reason="Trailing Stop")
-                            break
-                        days_held = (today - pos['buy_date']).days
-                        if self.strategy.get_sell_signal(ticker, current_price, pos.to_dict(), days_held):
-                            self.sell(ticker, current_price, today, index, reason="Strategy Signal")
-                            break
-                else:
-                    if self.strategy.get_buy_signal(ticker, current_price):
-                        self.buy(ticker, current_price, today)
+            if self.early_stop is not None and self.early_stop(self.metrics):
+                self.logger.info(f"{today.date()} - Early stop: Sharpe {self.metrics.sharpe:.2f}, "
+                                 f"drawdown {self.metrics.max_drawdown * 100:.2f}% after {self.metrics.bars} bars")
+                break
+
+            for sleeve in self.sleeves:
+                self._evaluate_sleeve(sleeve, today)
 
         self.logger.info("--- Simulation Complete ---")
-        self._process_results(equity_curve)
+        return self._process_results(equity_curve)
 
     def _process_results(self, equity_curve_data):
         self.logger.info("\n" + "=" * 50 + "\nBACKTEST RESULTS\n" + "=" * 50)
         equity_df = pd.DataFrame(equity_curve_data).set_index('date')
 
         last_day = equity_df.index[-1]
-        for index, pos in self.positions.iterrows():
-            last_price = self.all_ticker_data[pos['symbol']].loc[last_day]['Close']
-            self.sell(pos['symbol'], last_price, last_day, index, reason="End of Simulation")
-
-        last_day_qqq_price = self.all_benchmark_data['QQQ']['Close'].iloc[-1]
+        for sleeve in self.sleeves:
+            while not sleeve.positions.empty:
+                pos = sleeve.positions.iloc[0]
+                last_price = self.indicators.price(pos['symbol'])
+                self.sell(sleeve, pos['symbol'], last_price, last_day, sleeve.positions.index[0],
+                          reason="End of Simulation")
+
+        last_day_qqq_price = self.all_benchmark_data['QQQ']['Close'].loc[last_day]
         final_passive_value = self.qqq_shares * last_day_qqq_price
-        final_active_value = self.cash
+        final_active_value = sum(sleeve.cash for sleeve in self.sleeves)
         final_total_value = final_active_value + final_passive_value
 
         total_return = (final_total_value / self.initial_capital - 1) * 100
 
         nasdaq_prices = self.all_benchmark_data['^NDX']['Close'].loc[equity_df.index]
         sp500_prices = self.all_benchmark_data['^GSPC']['Close'].loc[equity_df.index]
-        portfolio_returns = equity_df['value'].pct_change().dropna()
-        nasdaq_returns = nasdaq_prices.pct_change().dropna()
-
-        def calculate_sharpe(returns):
-            return (returns.mean() / returns.std()) * np.sqrt(252) if returns.std() != 0 else 0
-
-        def calculate_max_drawdown(prices):
-            return ((prices - prices.cummax()) / prices.cummax()).min()
-
-        portfolio_sharpe = calculate_sharpe(portfolio_returns)
-        nasdaq_sharpe = calculate_sharpe(nasdaq_returns)
-        portfolio_max_drawdown = calculate_max_drawdown(equity_df['value'])
-        nasdaq_max_drawdown = calculate_max_drawdown(nasdaq_prices)
+        portfolio_sharpe = self.metrics.sharpe
+        nasdaq_sharpe = self.nasdaq_metrics.sharpe
+        portfolio_max_drawdown = self.metrics.max_drawdown
+        nasdaq_max_drawdown = self.nasdaq_metrics.max_drawdown
 
         self.logger.info(f"Initial Total Capital:    ${self.initial_capital:,.2f}")
         self.logger.info(f"Final Total Portfolio Value: ${final_total_value:,.2f}")
@@ -219,15 +400,50 @@ class Backtester:
         self.logger.info(f"Sharpe Ratio:             {portfolio_sharpe:.2f}  (NASDAQ 100: {nasdaq_sharpe:.2f})")
         self.logger.info(
             f"Max Drawdown:             {portfolio_max_drawdown * 100:.2f}% (NASDAQ 100: {nasdaq_max_drawdown * 100:.2f}%)")
-
-        print("\n--- P&L Summary for Active Trades ---")
-        if not self.trades_log.empty:
-            pnl_by_ticker = self.trades_log.groupby('symbol')['pnl'].sum().sort_values(ascending=False)
-            print(pnl_by_ticker.to_string())
-            self.logger.info(f"\nTotal Net P&L from active trades: ${self.trades_log['pnl'].sum():,.2f}")
-            self.logger.info(f"Total Active Trades Made: {len(self.trades_log)}")
-            win_rate = (len(self.trades_log[self.trades_log['pnl'] > 0]) / len(self.trades_log) * 100)
-            self.logger.info(f"Win Rate: {win_rate:.2f}%")
+        self.logger.info(f"Last {self.metrics.window} Bars:            Sharpe {self.metrics.rolling_sharpe:.2f}, "
+                         f"Max Drawdown {self.metrics.rolling_max_drawdown * 100:.2f}%")
+
+        sleeve_curves = {}
+        for sleeve in self.sleeves:
+            sleeve_values = pd.DataFrame(sleeve.equity_curve).set_index('date')['value']
+            sleeve_curves[sleeve.name] = sleeve_values
+            sleeve_sharpe = sleeve.metrics.sharpe
+            sleeve_max_drawdown = sleeve.metrics.max_drawdown
+            sleeve_pnl = sleeve.cash - sleeve.capital_base
+            self.logger.info(f"\n--- Sleeve '{sleeve.name}' ---")
+            self.logger.info(f"Final Value:              ${sleeve.cash:,.2f} (P&L: ${sleeve_pnl:,.2f}, "
+                             f"{(sleeve.cash / sleeve.capital_base - 1) * 100:.2f}%)")
+            self.logger.info(f"Sharpe Ratio:             {sleeve_sharpe:.2f}")
+            self.logger.info(f"Max Drawdown:             {sleeve_max_drawdown * 100:.2f}%")
+            if sleeve.metrics.trades:
+                self.logger.info(f"Trades Made:              {sleeve.metrics.trades}")
+                self.logger.info(f"Win Rate:                 {sleeve.metrics.win_rate:.2f}%")
+
+        if not self.quiet:
+            print("\n--- P&L Summary for Active Trades ---")
+        if self.metrics.trades:
+            pnl_by_ticker = pd.Series(self.metrics.pnl_by_ticker).sort_values(ascending=False)
+            if not self.quiet:
+                print(pnl_by_ticker.to_string())
+            self.logger.info(f"\nTotal Net P&L from active trades: ${pnl_by_ticker.sum():,.2f}")
+            self.logger.info(f"Total Active Trades Made: {self.metrics.trades}")
+            self.logger.info(f"Win Rate: {self.metrics.win_rate:.2f}%")
+
+        summary = {
+            'final_value': final_total_value,
+            'total_return': total_return,
+            'active_pnl': active_pnl,
+            'sharpe': portfolio_sharpe,
+            'max_drawdown': portfolio_max_drawdown,
+            'nasdaq_sharpe': nasdaq_sharpe,
+            'nasdaq_max_drawdown': nasdaq_max_drawdown,
+            'trades': self.metrics.trades,
+            'win_rate': self.metrics.win_rate,
+            'bars': self.metrics.bars,
+            'early_stopped': self.metrics.bars < len(self.all_benchmark_data['^NDX'].index),
+        }
+        if self.quiet:
+            return summary
 
         plt.style.use('seaborn-v0_8-darkgrid')
         plt.figure(figsize=(14, 7))
@@ -235,11 +451,16 @@ class Backtester:
         nasdaq_pct = (nasdaq_prices / nasdaq_prices.iloc[0] - 1) * 100
         sp500_pct = (sp500_prices / sp500_prices.iloc[0] - 1) * 100
 
-        plt.plot(portfolio_pct, label=f'50/50 Portfolio (Sharpe: {portfolio_sharpe:.2f})', color='royalblue')
+        portfolio_name = f'{(1 - self.passive_weight) * 100:g}/{self.passive_weight * 100:g} Portfolio'
+        plt.plot(portfolio_pct, label=f'{portfolio_name} (Sharpe: {portfolio_sharpe:.2f})', color='royalblue')
         plt.plot(nasdaq_pct, label=f'NASDAQ 100 (Sharpe: {nasdaq_sharpe:.2f})', color='orange', linestyle='--')
         plt.plot(sp500_pct, label='S&P 500', color='green', linestyle=':')
+        if len(self.sleeves) > 1:
+            for name, sleeve_values in sleeve_curves.items():
+                sleeve_pct = (sleeve_values / sleeve_values.iloc[0] - 1) * 100
+                plt.plot(sleeve_pct, label=f'Sleeve: {name}', linewidth=1, alpha=0.7)
 
-        plt.title('50/50 Portfolio vs. Benchmarks (Percentage Change)', fontsize=16)
+        plt.title(f'{portfolio_name} vs. Benchmarks (Percentage Change)', fontsize=16)
         plt.ylabel('Percentage Change (%)')
         plt.xlabel('Date')
         plt.legend()
@@ -247,6 +468,7 @@ class Backtester:
         plt.savefig('equity_curve.png')
         self.logger.info(f"\nEquity curve plot saved to equity_curve.png")
         plt.show()
+        return summary
 
 
 if __name__ == '__main__':
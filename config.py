@@ -1 +1,6 @@
 ID_PAPER = "DUN505877"
+STATE_DB_PATH = "bot_state.db"
+HISTORICAL_DATA_FROM_IB = False
+USE_BROKER_STOPS = False
+SELECTION = "ordered"
+TOP_K = 5
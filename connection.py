@@ -1,5 +1,9 @@
 import threading
+import time
+from collections import deque
 from queue import Queue
+import numpy as np
+import pandas as pd
 from ibapi.client import EClient
 from ibapi.wrapper import EWrapper
 from ibapi.contract import Contract
@@ -7,6 +11,88 @@ from ibapi.order import Order
 from ibapi.common import TickerId, OrderId
 from ibapi.ticktype import TickTypeEnum, TickType
 from ibapi.order_state import OrderState
+from order_manager import OrderManager
+
+
+# yfinance style index symbols -> (IB symbol, secType, exchange)
+INDEX_CONTRACTS = {
+    '^NDX': ("NDX", "IND", "NASDAQ"),
+    '^GSPC': ("SPX", "IND", "CBOE"),
+}
+
+
+class Pacer:
+    # sliding-window rate limiter: at most max_requests per window seconds, and at most
+    # max_in_flight requests that have been acquired but not yet released. either limit can be None
+    def __init__(self, max_requests, window=1.0, max_in_flight=None):
+        self.max_requests = max_requests
+        self.window = window
+        self.max_in_flight = max_in_flight
+        self.sent = deque()
+        self.in_flight = 0
+        self.condition = threading.Condition()
+
+    def acquire(self):
+        with self.condition:
+            while True:
+                now = time.monotonic()
+                while self.sent and now - self.sent[0] >= self.window:
+                    self.sent.popleft()
+                window_full = self.max_requests is not None and len(self.sent) >= self.max_requests
+                too_many_open = self.max_in_flight is not None and self.in_flight >= self.max_in_flight
+                if not window_full and not too_many_open:
+                    if self.max_requests is not None:
+                        self.sent.append(now)
+                    self.in_flight += 1
+                    return
+                wait_time = self.window - (now - self.sent[0]) if window_full else 1.0
+                self.condition.wait(timeout=wait_time)
+
+    def release(self):
+        with self.condition:
+            self.in_flight -= 1
+            self.condition.notify_all()
+
+
+class BarBuffer:
+    # historicalData callbacks are written straight into preallocated numpy columns
+    FIELDS = ('Open', 'High', 'Low', 'Close', 'Volume')
+
+    def __init__(self, capacity=512):
+        self.size = 0
+        self.times = np.empty(capacity, dtype=np.int64)  # epoch seconds
+        self.values = np.empty((len(self.FIELDS), capacity), dtype=np.float64)
+
+    def append(self, bar):
+        if self.size == self.times.shape[0]:
+            self.times = np.resize(self.times, self.size * 2)
+            values = np.empty((len(self.FIELDS), self.size * 2), dtype=np.float64)
+            values[:, :self.size] = self.values
+            self.values = values
+        i = self.size
+        date = bar.date.split()[0]
+        if len(date) == 8:  # daily bars come back as yyyymmdd even with formatDate=2
+            self.times[i] = np.datetime64(f"{date[:4]}-{date[4:6]}-{date[6:]}", 's').astype(np.int64)
+        else:
+            self.times[i] = int(date)
+        self.values[0, i] = bar.open
+        self.values[1, i] = bar.high
+        self.values[2, i] = bar.low
+        self.values[3, i] = bar.close
+        self.values[4, i] = float(bar.volume)
+        self.size += 1
+
+    def to_frame(self) -> pd.DataFrame:
+        index = pd.DatetimeIndex(self.times[:self.size].astype('datetime64[s]').astype('datetime64[ns]'), name='Date')
+        return pd.DataFrame({field: self.values[k, :self.size] for k, field in enumerate(self.FIELDS)}, index=index)
+
+
+def historical_request_window(start_date, end_date):
+    # IB wants an end time plus a duration instead of a start date; durations over a year must be in years
+    start, end = pd.Timestamp(start_date), pd.Timestamp(end_date)
+    days = (end - start).days + 1
+    duration = f"{days} D" if days <= 365 else f"{-(-days // 365)} Y"
+    return end.strftime('%Y%m%d 23:59:59') + " US/Eastern", duration
 
 
 class Connection(EWrapper, EClient):
@@ -17,8 +103,18 @@ class Connection(EWrapper, EClient):
         self.event_queue = event_queue
         self.requests = []
         self.next_reqId = 0
-        self.active_orders = {}
+        # IB's 50 messages/second limit counts every message on the connection, so order placement
+        # and history requests draw from the same pacer
+        self.message_pacer = Pacer(max_requests=50, window=1.0)
+        self.order_manager = OrderManager(self, event_queue, self.message_pacer)
         self.positions_event = threading.Event()
+        self.historical_buffers = {}
+        self.historical_symbols = {}
+        self.historical_done = {}
+        self.historical_failed = set()
+        self.historical_pacing = {}  # reqId -> pacer slot to release when the request finishes
+        self.historical_pacer = Pacer(max_requests=None, max_in_flight=50)  # open history requests
+        self.small_bar_pacer = Pacer(max_requests=60, window=600.0, max_in_flight=50)
         self.tickers = [
             "MSFT", "AAPL", "NVDA", "AMZN", "GOOGL", "GOOG", "META", "AVGO",
             "TSLA", "COST", "AMD", "PEP", "ADBE", "NFLX", "QCOM", "LIN",
@@ -44,6 +140,10 @@ class Connection(EWrapper, EClient):
 
     def error(self, reqId, errorCode, errorString, advancedOrderRejectJson=""):
         super().error(reqId, errorCode, errorString)
+        if reqId in self.historical_done and errorCode < 2000:
+            print(f"Historical data request for {self.historical_symbols[reqId]} failed: {errorString}")
+            self.historical_failed.add(reqId)
+            self._finish_historical(reqId)
         if errorCode < 2000:
             self.event_queue.put({'event_type': 'ERROR', 'reqId': reqId, 'code': errorCode, 'message': errorString})
 
@@ -55,40 +155,59 @@ class Connection(EWrapper, EClient):
         contract.exchange = exchange
         return contract
 
-    def create_order(self, action, quantity, orderType="MKT",lmtPrice=0, tif="DAY"):
+    def contract_for_symbol(self, symbol):
+        if symbol in INDEX_CONTRACTS:
+            ib_symbol, sec_type, exchange = INDEX_CONTRACTS[symbol]
+            return self.create_contract(ib_symbol, secType=sec_type, exchange=exchange)
+        return self.create_contract(symbol)
+
+    def create_order(self, action, quantity, orderType="MKT",lmtPrice=0, tif="DAY", trailingPercent=None):
         order = Order()
         order.action = action
         order.totalQuantity = quantity
         order.lmtPrice = lmtPrice
         order.orderType = orderType
         order.tif = tif
+        if trailingPercent is not None: # orderType="TRAIL", IB trails the stop on its side
+            order.trailingPercent = trailingPercent
         order.eTradeOnly = False
         order.firmQuoteOnly = False
         return order
 
+    def create_order_with_trailing_stop(self, action, quantity, trail_percent, orderType="MKT", lmtPrice=0):
+        # entry order plus a GTC trailing stop child that IB only activates once the entry fills.
+        # place_orders() links the child to the parent id and transmits both together
+        parent = self.create_order(action, quantity, orderType=orderType, lmtPrice=lmtPrice)
+        parent.transmit = False
+        exit_action = "SELL" if action == "BUY" else "BUY"
+        child = self.create_order(exit_action, quantity, orderType="TRAIL", tif="GTC", trailingPercent=trail_percent)
+        child.transmit = True
+        return [parent, child]
+
     def place_new_order(self, contract: Contract, order: Order):
-        order_id = self.next_order_id
-        self.next_order_id += 1
-        self.active_orders[order_id] = {"symbol": contract.symbol, "action": order.action,
-                                        "quantity": order.totalQuantity}
-        print(f"Placing Order {order_id}: {order.action} {order.totalQuantity} of {contract.symbol}")
-        self.placeOrder(order_id, contract, order)
+        return self.place_orders([(contract, order)])[0]
+
+    def place_orders(self, batch, protective=False):
+        return self.order_manager.submit_batch(batch, protective)
+
+    def cancel_order(self, order_id):
+        print(f"Cancelling Order {order_id}")
+        self.cancelOrder(order_id, "")
 
     def orderStatus(self, orderId, status, filled, remaining, avgFillPrice, permId, parentId, lastFillPrice, clientId,
                     whyHeld, mktCapPrice):
         super().orderStatus(orderId, status, filled, remaining, avgFillPrice, permId, parentId, lastFillPrice, clientId,
                             whyHeld, mktCapPrice)
-        if orderId in self.active_orders:
-            print(
-                f"Order Status Update - ID: {orderId}, Symbol: {self.active_orders[orderId]['symbol']}, Status: {status}")
-            if status == "Filled":
-                fill_event = {'event_type': 'FILL', 'symbol': self.active_orders[orderId]['symbol'],
-                              'action': self.active_orders[orderId]['action'], 'quantity': filled,
-                              'fill_price': avgFillPrice}
-                self.event_queue.put(fill_event)
-                del self.active_orders[orderId]
-            elif status in ["Cancelled", "ApiCancelled", "Inactive"]:
-                if orderId in self.active_orders: del self.active_orders[orderId]
+        self.order_manager.on_order_status(orderId, status, filled, remaining, avgFillPrice)
+
+    def openOrder(self, orderId, contract, order, orderState):
+        super().openOrder(orderId, contract, order, orderState)
+        self.event_queue.put({'event_type': 'OPEN_ORDER', 'order_id': orderId, 'symbol': contract.symbol,
+                              'order_type': order.orderType, 'status': orderState.status})
+
+    def openOrderEnd(self):
+        super().openOrderEnd()
+        self.event_queue.put({'event_type': 'OPEN_ORDERS_END'})
 
     def request_account_summary(self):
         reqId = self.next_reqId
@@ -116,6 +235,7 @@ class Connection(EWrapper, EClient):
     def positionEnd(self):
         print("Position data request finished.")
         self.cancelPositions()
+        self.event_queue.put({'event_type': 'POSITIONS_END'})
 
     def request_market_data(self, symbol: str) -> int:
         reqId = self.next_reqId;
@@ -147,4 +267,57 @@ class Connection(EWrapper, EClient):
         }
         self.event_queue.put(pnl_event)
 
+    def request_historical_bars(self, symbols, duration="1 Y", bar_size="1 day", end_date_time="",
+                                what_to_show="TRADES", use_rth=1, timeout=300) -> dict:
+        # sends one reqHistoricalData per symbol with as many in flight as the pacer allows and
+        # within the shared message rate, then waits for all of them. returns {symbol: DataFrame}
+        # in the same layout as yfinance
+        small_bars = bar_size.split()[-1].startswith("sec")
+        pacer = self.small_bar_pacer if small_bars else self.historical_pacer
+        req_ids = []
+        for symbol in symbols:
+            pacer.acquire()
+            reqId = self.next_reqId
+            self.next_reqId += 1
+            self.historical_buffers[reqId] = BarBuffer()
+            self.historical_symbols[reqId] = symbol
+            self.historical_done[reqId] = threading.Event()
+            self.historical_pacing[reqId] = pacer
+            req_ids.append(reqId)
+            self.message_pacer.acquire()
+            self.reqHistoricalData(reqId, self.contract_for_symbol(symbol), end_date_time, duration, bar_size,
+                                   what_to_show, use_rth, 2, False, [])
+            self.message_pacer.release()
+        print(f"Requested historical bars for {len(req_ids)} symbols ({duration}, {bar_size})")
+
+        deadline = time.monotonic() + timeout
+        frames = {}
+        for reqId in req_ids:
+            symbol = self.historical_symbols[reqId]
+            finished = self.historical_done[reqId].wait(max(0.0, deadline - time.monotonic()))
+            if not finished:
+                print(f"Timed out waiting for historical data for {symbol}")
+                self.cancelHistoricalData(reqId)
+                self._finish_historical(reqId)
+            elif reqId not in self.historical_failed and self.historical_buffers[reqId].size > 0:
+                frames[symbol] = self.historical_buffers[reqId].to_frame()
+            del self.historical_buffers[reqId], self.historical_symbols[reqId], self.historical_done[reqId]
+            self.historical_failed.discard(reqId)
+        print(f"Historical data received for {len(frames)} of {len(req_ids)} symbols.")
+        return frames
+
+    def historicalData(self, reqId, bar):
+        buffer = self.historical_buffers.get(reqId)
+        if buffer is not None:
+            buffer.append(bar)
+
+    def historicalDataEnd(self, reqId: int, start: str, end: str):
+        super().historicalDataEnd(reqId, start, end)
+        self._finish_historical(reqId)
 
+    def _finish_historical(self, reqId):
+        pacer = self.historical_pacing.pop(reqId, None)
+        if pacer is not None:
+            pacer.release()
+        if reqId in self.historical_done:
+            self.historical_done[reqId].set()
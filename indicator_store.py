@@ -0,0 +1,182 @@
+import time
+
+import numpy as np
+import pandas as pd
+import talib as ta
+
+PRICE_FIELDS = ('Open', 'High', 'Low', 'Close', 'Volume')
+INDICATORS = ('SMA', 'upper_band', 'lower_band', 'RSI', 'ATR', 'ATR_SMA', 'macd_line', 'signal_line', 'hist')
+
+
+def compute_indicators(data: pd.DataFrame) -> dict:
+    # the strategy's indicators for one ticker's bars, as float64 arrays aligned with data.
+    # all of them are causal, so reading the full history's values up to a day gives the same
+    # numbers as recomputing on the slice that ends on that day
+    close = data['Close']
+    sma = close.rolling(window=30).mean()
+    std = close.rolling(30).std()
+    atr = ta.ATR(data['High'].values, data['Low'].values, close.values, timeperiod=14)
+    macd, macdsignal, macdhist = ta.MACD(close.values, fastperiod=24, slowperiod=52, signalperiod=18)
+    return {
+        'SMA': sma.values,
+        'upper_band': (sma + 2 * std).values,
+        'lower_band': (sma - 2 * std).values,
+        'RSI': ta.RSI(close.values, timeperiod=14),
+        'ATR': atr,
+        'ATR_SMA': pd.Series(atr).rolling(window=30).mean().values,
+        'macd_line': macd,
+        'signal_line': macdsignal,
+        'hist': macdhist,
+    }
+
+
+class IndicatorStore:
+    # prices and indicators of a whole universe on one shared date index. every field is a single
+    # C-ordered (dates x tickers) array: a day's cross-section is one contiguous row, and a ticker's
+    # history up to the cursor is a strided view of its column, so reading either copies nothing.
+    # indicators are computed once over the full history, set_date() only moves the cursor.
+    # prices stay float64 for the cash accounting, dtype applies to the indicators
+    def __init__(self, frames: dict, benchmark: pd.DataFrame = None, dtype=np.float64):
+        frames = {ticker: df for ticker, df in frames.items() if not df.empty}
+        self.tickers = list(frames)
+        self.column = {ticker: j for j, ticker in enumerate(self.tickers)}
+        self.dtype = np.dtype(dtype)
+        if frames:
+            first, *rest = frames.values()
+            self.dates = first.index.append([df.index for df in rest]).unique().sort_values()
+        else:
+            self.dates = pd.DatetimeIndex([])
+        n_dates, n_tickers = len(self.dates), len(self.tickers)
+
+        self.arrays = {field: np.full((n_dates, n_tickers), np.nan) for field in PRICE_FIELDS}
+        self.arrays.update({name: np.full((n_dates, n_tickers), np.nan, dtype=self.dtype) for name in INDICATORS})
+        self.first_row = np.zeros(n_tickers, dtype=np.int64)
+        self.last_row = np.full(n_tickers, -1, dtype=np.int64)
+        self.gap_rows = {}  # column -> its rows, only for tickers missing some dates inside their range
+
+        for j, (ticker, data) in enumerate(frames.items()):
+            rows = self.dates.get_indexer(data.index)
+            self.first_row[j], self.last_row[j] = rows[0], rows[-1]
+            if rows[-1] - rows[0] + 1 == rows.shape[0]:
+                rows = slice(rows[0], rows[-1] + 1)
+            else:
+                self.gap_rows[j] = rows
+            for field in PRICE_FIELDS:
+                if field in data:
+                    self.arrays[field][rows, j] = data[field].values
+            for name, values in compute_indicators(data).items():
+                self.arrays[name][rows, j] = values
+
+        self.benchmark_dates = None
+        if benchmark is not None:
+            self.benchmark_dates = benchmark.index
+            self.benchmark_close = benchmark['Close'].values.astype(np.float64)
+            self.benchmark_sma = benchmark['Close'].rolling(window=200).mean().values
+        self.cursor = n_dates - 1
+        self.on_date = n_dates > 0  # whether the cursor row is the requested date itself
+        self.benchmark_row = len(self.benchmark_dates) - 1 if self.benchmark_dates is not None else -1
+
+    def set_date(self, date):
+        # everything read afterwards ends on the last bar at or before date
+        self.cursor = self.dates.searchsorted(date, side='right') - 1
+        self.on_date = self.cursor >= 0 and self.dates[self.cursor] == date
+        if self.benchmark_dates is not None:
+            self.benchmark_row = self.benchmark_dates.searchsorted(date, side='right') - 1
+
+    def is_bullish(self) -> bool:
+        if self.benchmark_row < 0:
+            return False
+        return self.benchmark_close[self.benchmark_row] > self.benchmark_sma[self.benchmark_row]
+
+    def history(self, name, ticker) -> np.ndarray:
+        # the ticker's values up to the cursor, a view into the shared array
+        j = self.column.get(ticker)
+        if j is None:
+            return np.empty(0, dtype=self.arrays[name].dtype)
+        if j not in self.gap_rows:
+            return self.arrays[name][self.first_row[j]:min(self.cursor, self.last_row[j]) + 1, j]
+        rows = self.gap_rows[j]  # a copy, gathered over the ticker's own rows
+        return self.arrays[name][rows[:rows.searchsorted(self.cursor, side='right')], j]
+
+    def price(self, ticker, field='Close'):
+        # today's bar like frame.loc[today][field]: KeyError when the ticker has no bar on the date
+        # passed to set_date, even if an earlier one is under the cursor
+        value = self.arrays[field][self.cursor, self.column[ticker]] if self.on_date else np.nan
+        if np.isnan(value):
+            raise KeyError(ticker)
+        return value
+
+    def positions(self, tickers, columns=None):
+        # per ticker: row of its last bar up to the cursor, row of the bar before, and its bar count.
+        # rows are -1 where there is no such bar, tickers not in the store count 0 bars.
+        # columns, when given, are the tickers' columns (-1 for missing ones) and skip the lookups
+        if columns is None:
+            columns = np.array([self.column.get(ticker, -1) for ticker in tickers], dtype=np.int64)
+        columns = np.asarray(columns, dtype=np.int64)
+        known = columns >= 0
+        safe = np.where(known, columns, 0)
+        last = np.minimum(self.cursor, self.last_row[safe])
+        counts = np.where(known, np.maximum(last - self.first_row[safe] + 1, 0), 0)
+        prev = last - 1
+        gapped = np.flatnonzero(np.isin(columns, list(self.gap_rows))) if self.gap_rows else []
+        for i in gapped:
+            rows = self.gap_rows[columns[i]]
+            counts[i] = rows.searchsorted(self.cursor, side='right')
+            last[i] = rows[counts[i] - 1] if counts[i] > 0 else -1
+            prev[i] = rows[counts[i] - 2] if counts[i] > 1 else -1
+        last = np.where(counts > 0, last, -1)
+        prev = np.where(counts > 1, prev, -1)
+        return columns, last, prev, counts
+
+    def take(self, name, rows, columns, where) -> np.ndarray:
+        # float64 values at (rows[i], columns[i]), NaN wherever where is False
+        values = self.arrays[name][np.maximum(rows, 0), np.maximum(columns, 0)].astype(np.float64)
+        values[~where] = np.nan
+        return values
+
+    def memory_report(self) -> dict:
+        bar_counts = np.array([len(self.gap_rows[j]) if j in self.gap_rows else self.last_row[j] - self.first_row[j] + 1
+                               for j in range(len(self.tickers))], dtype=np.int64)
+        bars = int(bar_counts.sum())
+        store_bytes = (sum(array.nbytes for array in self.arrays.values()) + self.dates.nbytes
+                       + self.first_row.nbytes + self.last_row.nbytes
+                       + sum(rows.nbytes for rows in self.gap_rows.values()))
+        # the per-ticker layout this replaces: eight float64 Series (SMA, both bands, RSI, ATR and the
+        # three MACD lines) and an OHLCV frame, each carrying its own copy of the ticker's DatetimeIndex.
+        # the backtest rebuilt all eight Series every day on the slice ending that day
+        series_bytes = bars * (8 * (8 + 8) + len(PRICE_FIELDS) * 8 + 8)
+        rebuilt_bytes = int((bar_counts * (bar_counts + 1) // 2).sum()) * 8 * (8 + 8)
+        return {
+            'tickers': len(self.tickers),
+            'dates': len(self.dates),
+            'bars': bars,
+            'dtype': str(self.dtype),
+            'store_bytes': store_bytes,
+            'series_bytes': series_bytes,
+            'rebuilt_bytes': rebuilt_bytes,
+            'saving': 1 - store_bytes / series_bytes if series_bytes else 0.0,
+        }
+
+    def memory_summary(self) -> str:
+        report = self.memory_report()
+        return (f"Indicator store: {report['tickers']} tickers x {report['dates']} days ({report['dtype']}) "
+                f"in {report['store_bytes'] / 2 ** 20:,.1f} MB, per-ticker Series layout "
+                f"{report['series_bytes'] / 2 ** 20:,.1f} MB ({report['saving']:.0%} saved), "
+                f"{report['rebuilt_bytes'] / 2 ** 30:,.1f} GB of per-day Series rebuilds avoided over a backtest")
+
+
+if __name__ == '__main__':
+    # memory of the store against the per-ticker Series layout for large universes and long histories
+    rng = np.random.default_rng(11)
+    for n_tickers, years in ((100, 5), (500, 5), (500, 10), (1000, 10)):
+        n_days = 252 * years
+        index = pd.bdate_range("2010-01-01", periods=n_days)
+        frames = {}
+        for i in range(n_tickers):
+            close = 100 * np.exp(np.cumsum(rng.normal(0.0003, 0.02, n_days)))
+            frames[f"T{i:04d}"] = pd.DataFrame({'Open': close, 'High': close * 1.01, 'Low': close * 0.99,
+                                                'Close': close, 'Volume': 1e6}, index=index)
+        for dtype in (np.float64, np.float32):
+            start = time.perf_counter()
+            store = IndicatorStore(frames, dtype=dtype)
+            print(f"{store.memory_summary()}, built in {time.perf_counter() - start:.1f}s")
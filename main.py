@@ -3,6 +3,8 @@ from queue import Queue, Empty  # for our threads
 from datetime import datetime
 from strategy_mean_momentum import mean_momentum_strategy
 from connection import Connection
+from state_store import StateStore
+from metrics import MetricsAccumulator
 import config
 
 class bot():
@@ -11,16 +13,33 @@ class bot():
         self.connection = Connection(self.event_queue)
         self.strategy = mean_momentum_strategy()
 
+        self.store = StateStore(config.STATE_DB_PATH)
         self.cash_balance = 0.0  #cash for buying assests
-        self.portfolio = {}  # positions_data + buy_date + stop_loss_price
+        self.portfolio = self.store.load_portfolio()  # positions_data + buy_date + stop_loss_price
+        self.reported_positions = set()  # symbols IB reported since request_positions()
         self.market_data = {}
         self.req_to_ticker = {}
         self.pnl_data = {'daily': 0.0, 'unrealized': 0.0, 'realized': 0.0}
+        self.trail_percentage = 0.10
+        self.use_broker_stops = config.USE_BROKER_STOPS  # attach an IB TRAIL order at entry
+        self.pending_stops = {}  # ticker -> stop order id of an entry that hasn't filled yet
+        self.restored_stops = {}  # ticker -> stop order id restored from the store, until IB confirms it
+        self.reported_orders = set()  # order ids IB reported since reqOpenOrders()
+        self.metrics = MetricsAccumulator(window=20)  # one bar per signal scan
+        self.selection = config.SELECTION  # "ordered" or "ranked" (top config.TOP_K candidates per scan)
 
     def connect_and_initialize(self):
         self.connection.Connect_to_IB() # connecct to InterActive Broker
-        self.strategy.historical_data()  # download all the data from yahoo
+        # download all the data from yahoo, or from IB itself
+        self.strategy.historical_data(self.connection if config.HISTORICAL_DATA_FROM_IB else None)
         self.connection.request_account_summary()
+        self.connection.request_positions() # reconcile the restored portfolio with the broker
+        for symbol, position in self.portfolio.items():
+            if position.get('stop_order_id') is not None:
+                self.connection.order_manager.track_existing(position['stop_order_id'], symbol, "SELL",
+                                                             position['quantity'])
+                self.restored_stops[symbol] = position['stop_order_id']
+        self.connection.reqOpenOrders() # status of stop orders left working by the last session
         self.connection.subscribe_to_pnl_updates(config.ID_PAPER) # subscribing to pnl updates
 
         # initializing getting market data for all the tickers and saving the req_id for receiving the data
@@ -46,10 +65,23 @@ class bot():
                         self.cash_balance = float(event['value'])
                 elif event_type == 'POSITION_DATA':
                 # This populates initial positions
+                    if event['quantity'] == 0:
+                        if event['symbol'] in self.portfolio:
+                            del self.portfolio[event['symbol']]
+                            self.store.remove_position(event['symbol'])
+                        continue
+                    self.reported_positions.add(event['symbol'])
                     if event['symbol'] not in self.portfolio:
                         self.portfolio[event['symbol']] = {}
                     self.portfolio[event['symbol']]['quantity'] = event['quantity']
                     self.portfolio[event['symbol']]['average_cost'] = event['average_cost']
+                    self.store.save_position(event['symbol'], self.portfolio[event['symbol']])
+                elif event_type == 'POSITIONS_END':
+                    self.drop_unreported_positions()
+                elif event_type == 'OPEN_ORDER':
+                    self.reported_orders.add(event['order_id'])
+                elif event_type == 'OPEN_ORDERS_END':
+                    self.replace_lost_stops()
 
                 elif event_type == 'TICK_PRICE':
                     ticker = self.req_to_ticker.get(event['reqId'])
@@ -63,72 +95,183 @@ class bot():
                     self.pnl_data['daily'] = event['daily_pnl']
                     self.pnl_data['unrealized'] = event['unrealized_pnl']
                     self.pnl_data['realized'] = event['realized_pnl']
+                    self.store.record_pnl(self.pnl_data, self.cash_balance)
                 elif event_type == 'ERROR':
                     print(f"API ERROR: {event}")
         except Empty:
             pass
 
+    def drop_unreported_positions(self):
+        # IB only reports open positions, so restored ones it left out were closed while we were away
+        for symbol in [s for s in self.portfolio if s not in self.reported_positions]:
+            print(f"Position in {symbol} no longer held at IB, removing it")
+            stop_order_id = self.portfolio[symbol].get('stop_order_id')
+            if stop_order_id is not None:
+                self.connection.cancel_order(stop_order_id)
+            del self.portfolio[symbol]
+            self.store.remove_position(symbol)
+        self.reported_positions = set()
+
+    def replace_lost_stops(self):
+        # a restored stop IB didn't report was cancelled or expired while we were away. without a
+        # replacement the position would have no stop at all: re-attach a TRAIL order, or fall back
+        # to a local stop when broker stops are off
+        replacements = []
+        for symbol, order_id in self.restored_stops.items():
+            position = self.portfolio.get(symbol)
+            if order_id in self.reported_orders or position is None or position.get('stop_order_id') != order_id:
+                continue
+            print(f"Stop order {order_id} for {symbol} is no longer working at IB")
+            self.connection.order_manager.forget(position.pop('stop_order_id'))
+            if self.use_broker_stops:
+                replacements.append((self.connection.create_contract(symbol),
+                                     self.connection.create_order("SELL", position['quantity'], orderType="TRAIL",
+                                                                  tif="GTC",
+                                                                  trailingPercent=self.trail_percentage * 100)))
+            else:
+                position['stop_loss_price'] = position.get('average_cost', 0.0) * (1 - self.trail_percentage)
+                self.store.record_stop(symbol, position['stop_loss_price'])
+            self.store.save_position(symbol, position)
+
+        if replacements:
+            order_ids = self.connection.place_orders(replacements, protective=True)
+            for order_id, (contract, order) in zip(order_ids, replacements):
+                self.portfolio[contract.symbol]['stop_order_id'] = order_id
+                self.store.record_order(order_id, contract.symbol, order.action, order.totalQuantity, order.orderType)
+                self.store.save_position(contract.symbol, self.portfolio[contract.symbol])
+        self.restored_stops = {}
+        self.reported_orders = set()
+
     def on_fill(self, event):
         symbol = event['symbol']
         action = event['action'].upper()
+        self.store.record_fill(event.get('order_id'), symbol, action, event['quantity'], event['fill_price'])
 
+        # fill events carry only the newly filled quantity, partial fills add up
         if action == "BUY":
-            if symbol not in self.portfolio:
-                self.portfolio[symbol] = {}
-            self.portfolio[symbol]['quantity'] = event['quantity']
-            self.portfolio[symbol]['average_cost'] = event['fill_price']
-            self.portfolio[symbol]['buy_date'] = datetime.now()
-            self.portfolio[symbol]['stop_loss_price'] = event['fill_price'] * 0.90 # initial stop loss
-            # strategy type
-            self.portfolio[symbol]['strategy_type'] = "momentum" if self.strategy.is_bullish() else "mean_reversion"
+            if symbol not in self.portfolio or not self.portfolio[symbol].get('quantity'):
+                self.portfolio[symbol] = {'quantity': 0, 'average_cost': 0.0}
+                self.portfolio[symbol]['buy_date'] = datetime.now()
+                if symbol in self.pending_stops:
+                    self.portfolio[symbol]['stop_order_id'] = self.pending_stops.pop(symbol) # IB trails this one
+                else:
+                    self.portfolio[symbol]['stop_loss_price'] = event['fill_price'] * (1 - self.trail_percentage) # initial stop loss
+                # strategy type
+                self.portfolio[symbol]['strategy_type'] = "momentum" if self.strategy.is_bullish() else "mean_reversion"
+            position = self.portfolio[symbol]
+            new_quantity = position['quantity'] + event['quantity']
+            position['average_cost'] = (position['quantity'] * position['average_cost'] +
+                                        event['quantity'] * event['fill_price']) / new_quantity
+            position['quantity'] = new_quantity
+            self.store.save_position(symbol, position)
 
         elif action == "SELL":
-            # If we sold a position, remove it from our portfolio
             if symbol in self.portfolio:
-                del self.portfolio[symbol]
+                average_cost = self.portfolio[symbol].get('average_cost')
+                if average_cost is not None:
+                    self.metrics.add_trade(symbol, (event['fill_price'] - average_cost) * event['quantity'])
+                self.portfolio[symbol]['quantity'] = self.portfolio[symbol].get('quantity', 0) - event['quantity']
+                # If we sold the whole position, remove it from our portfolio
+                if self.portfolio[symbol]['quantity'] <= 0:
+                    stop_order_id = self.portfolio[symbol].get('stop_order_id')
+                    if stop_order_id is not None and stop_order_id != event.get('order_id'):
+                        self.connection.cancel_order(stop_order_id)
+                    del self.portfolio[symbol]
+                    self.store.remove_position(symbol)
+                else:
+                    self.store.save_position(symbol, self.portfolio[symbol])
 
         self.connection.request_account_summary()
 
 
+    def portfolio_value(self):
+        value = self.cash_balance
+        for symbol, position in self.portfolio.items():
+            price = self.market_data.get(symbol, {}).get('price') or position.get('average_cost', 0.0)
+            value += position.get('quantity', 0) * price
+        return value
+
+    def risk_snapshot(self) -> dict:
+        snapshot = self.metrics.snapshot()
+        snapshot['pnl'] = dict(self.pnl_data)
+        snapshot['open_exposure'] = self.connection.order_manager.open_exposure()
+        return snapshot
+
     def check_for_signals(self):
         print("Scanning for trading signals...")
+        self.metrics.update(self.portfolio_value())
+        orders_to_place = []  # sent together at the end of the scan
+        cash_committed = 0.0
+        buy_tickers = []
+        candidates = {}  # ticker -> price, for the ranked selection
 
         for ticker in self.strategy.tickers:
             data = self.market_data.get(ticker)
             if data is None or data.get('price') is None:
                 continue
+            if self.connection.order_manager.has_open_order(ticker):
+                continue  # don't stack a second order on one that is still working
 
             current_price = data['price']
 
             if ticker not in self.portfolio:
-                if self.strategy.get_buy_signal(ticker, current_price):
-                    print(f"BUY SIGNAL for {ticker} at {current_price}")
-
-                    investment = self.cash_balance * 0.1
-                    quantity = int(investment / current_price)
-
-                    if quantity > 0:
-                        contract = self.connection.create_contract(ticker)
-                        order = self.connection.create_order("BUY", quantity)
-                        self.connection.place_new_order(contract, order)
+                if self.selection == "ranked":
+                    candidates[ticker] = current_price
+                elif self.strategy.get_buy_signal(ticker, current_price):
+                    buy_tickers.append(ticker)
 
             else:
                 pos_data = self.portfolio[ticker]
 
-                # potential stoploss update
-                stop_loss_precentage = 0.10
-                potential_new_stop = current_price * (1 - stop_loss_precentage)
-                if potential_new_stop > pos_data.get('stop_loss_price', 0):
+                # potential stoploss update, not needed when IB trails the stop for us
+                potential_new_stop = current_price * (1 - self.trail_percentage)
+                if 'stop_order_id' not in pos_data and potential_new_stop > pos_data.get('stop_loss_price', 0):
                     self.portfolio[ticker]['stop_loss_price'] = potential_new_stop
+                    self.store.record_stop(ticker, potential_new_stop)
+                    self.store.save_position(ticker, self.portfolio[ticker])
 
                 # Calculate days held
                 days_held = (datetime.now() - pos_data.get('buy_date', datetime.now())).days
 
                 if self.strategy.get_sell_signal(ticker, current_price, pos_data, days_held):
                     print(f"SELL SIGNAL for {ticker} at {current_price}")
+                    if pos_data.get('stop_order_id') is not None:
+                        # pull the resting stop first so it can't fire on a position we are closing
+                        self.connection.cancel_order(pos_data.pop('stop_order_id'))
+                        self.store.save_position(ticker, pos_data)
                     contract = self.connection.create_contract(ticker)
-                    order = self.connection.create_order("SELL", pos_data['quantity'])
-                    self.connection.place_new_order(contract, order)
+                    orders_to_place.append((contract, self.connection.create_order("SELL", pos_data['quantity'])))
+
+        if candidates:
+            buy_tickers = self.strategy.rank_buy_candidates(list(candidates), list(candidates.values()), config.TOP_K)
+
+        for ticker in buy_tickers:
+            current_price = self.market_data[ticker]['price']
+            print(f"BUY SIGNAL for {ticker} at {current_price}")
+
+            investment = self.cash_balance * 0.1
+            quantity = int(investment / current_price)
+
+            if quantity > 0 and cash_committed + quantity * current_price <= self.cash_balance:
+                cash_committed += quantity * current_price
+                contract = self.connection.create_contract(ticker)
+                if self.use_broker_stops:
+                    orders = self.connection.create_order_with_trailing_stop("BUY", quantity,
+                                                                             self.trail_percentage * 100)
+                else:
+                    orders = self.connection.create_order("BUY", quantity)
+                orders_to_place.append((contract, orders))
+
+        if orders_to_place:
+            order_ids = self.connection.place_orders(orders_to_place)
+            for order_ids_entry, (contract, orders) in zip(order_ids, orders_to_place):
+                if isinstance(orders, list):  # entry + attached trailing stop
+                    self.pending_stops[contract.symbol] = order_ids_entry[1]
+                else:
+                    order_ids_entry, orders = [order_ids_entry], [orders]
+                for order_id, order in zip(order_ids_entry, orders):
+                    self.store.record_order(order_id, contract.symbol, order.action, order.totalQuantity,
+                                            order.orderType)
 
     def run(self):
         self.connect_and_initialize()
@@ -164,9 +307,13 @@ class bot():
         print(f"Final Positions: {self.portfolio}")
         print(
             f"Final PnL -> Daily: {self.pnl_data['daily']}, Unrealized: {self.pnl_data['unrealized']}")
+        print(f"Orders still working: {self.connection.order_manager.open_exposure()}")
+        print(f"Order latency: {self.connection.order_manager.latency_stats()}")
+        print(f"Risk: {self.risk_snapshot()}")
         print("=" * 50 + "\n")
 
         print("Run complete. Disconnecting.")
+        self.store.close()
         self.connection.disconnect()
 
 if __name__ == '__main__':
@@ -0,0 +1,129 @@
+import math
+from collections import deque
+
+
+class MetricsAccumulator:
+    # running performance figures, updated in O(1) per bar (amortized for the rolling peak).
+    # sharpe and max drawdown use the same definitions as the end-of-run pandas versions:
+    # mean/std (ddof=1) of bar returns * sqrt(periods_per_year), and (value - peak) / peak.
+    # the rolling max drawdown is computed when read, in O(window)
+    def __init__(self, periods_per_year=252, window=63):
+        self.periods_per_year = periods_per_year
+        self.window = window
+
+        self.bars = 0
+        self.last_value = None
+        self.returns_count = 0
+        self.returns_mean = 0.0
+        self.returns_m2 = 0.0  # Welford's sum of squared deviations
+        self.peak = None
+        self.drawdown = 0.0
+        self.max_drawdown = 0.0
+
+        # rolling window: returns with running sums, the last window values, and a monotonic
+        # deque of (bar, value) for the window's peak
+        self.window_returns = deque()
+        self.window_sum = 0.0
+        self.window_sum_sq = 0.0
+        self.window_values = deque(maxlen=window or None)
+        self.window_peaks = deque()
+        self.rolling_drawdown = 0.0
+
+        self.pnl_by_ticker = {}
+        self.trades = 0
+        self.wins = 0
+
+    def update(self, value):
+        if self.last_value is not None and self.last_value != 0:
+            self._add_return(value / self.last_value - 1)
+        self.last_value = value
+        self.bars += 1
+
+        if self.peak is None or value > self.peak:
+            self.peak = value
+        self.drawdown = (value - self.peak) / self.peak if self.peak else 0.0
+        self.max_drawdown = min(self.max_drawdown, self.drawdown)
+
+        if self.window:
+            oldest = self.bars - self.window
+            while self.window_peaks and self.window_peaks[-1][1] <= value:
+                self.window_peaks.pop()
+            self.window_peaks.append((self.bars, value))
+            while self.window_peaks[0][0] <= oldest:
+                self.window_peaks.popleft()
+            window_peak = self.window_peaks[0][1]
+            self.rolling_drawdown = (value - window_peak) / window_peak if window_peak else 0.0
+            self.window_values.append(value)
+
+    def _add_return(self, bar_return):
+        self.returns_count += 1
+        delta = bar_return - self.returns_mean
+        self.returns_mean += delta / self.returns_count
+        self.returns_m2 += delta * (bar_return - self.returns_mean)
+
+        if self.window:
+            self.window_returns.append(bar_return)
+            self.window_sum += bar_return
+            self.window_sum_sq += bar_return * bar_return
+            if len(self.window_returns) > self.window:
+                old_return = self.window_returns.popleft()
+                self.window_sum -= old_return
+                self.window_sum_sq -= old_return * old_return
+
+    def add_trade(self, symbol, pnl):
+        self.pnl_by_ticker[symbol] = self.pnl_by_ticker.get(symbol, 0.0) + pnl
+        self.trades += 1
+        if pnl > 0:
+            self.wins += 1
+
+    def _sharpe(self, mean, variance):
+        if variance <= 0:
+            return 0.0
+        return mean / math.sqrt(variance) * math.sqrt(self.periods_per_year)
+
+    @property
+    def sharpe(self):
+        if self.returns_count < 2:
+            return 0.0
+        return self._sharpe(self.returns_mean, self.returns_m2 / (self.returns_count - 1))
+
+    @property
+    def rolling_sharpe(self):
+        n = len(self.window_returns)
+        if n < 2:
+            return 0.0
+        mean = self.window_sum / n
+        variance = max(0.0, (self.window_sum_sq - n * mean * mean) / (n - 1))
+        return self._sharpe(mean, variance)
+
+    @property
+    def rolling_max_drawdown(self):
+        # max drawdown of the last window values alone, every trough measured against the
+        # highest value before it inside the window
+        peak = None
+        worst = 0.0
+        for value in self.window_values:
+            if peak is None or value > peak:
+                peak = value
+            if peak:
+                worst = min(worst, (value - peak) / peak)
+        return worst
+
+    @property
+    def win_rate(self):
+        return self.wins / self.trades * 100 if self.trades else 0.0
+
+    def snapshot(self) -> dict:
+        return {
+            'bars': self.bars,
+            'value': self.last_value,
+            'sharpe': self.sharpe,
+            'max_drawdown': self.max_drawdown,
+            'drawdown': self.drawdown,
+            'rolling_sharpe': self.rolling_sharpe,
+            'rolling_drawdown': self.rolling_drawdown,
+            'rolling_max_drawdown': self.rolling_max_drawdown,
+            'trades': self.trades,
+            'win_rate': self.win_rate,
+            'pnl_by_ticker': dict(self.pnl_by_ticker),
+        }
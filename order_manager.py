@@ -0,0 +1,127 @@
+import threading
+import time
+from collections import deque
+from queue import Queue
+
+
+class OrderManager:
+    # owns order ids and the state of every order we sent. orderStatus callbacks are turned
+    # into one FILL event per filled increment, so partial fills reach the bot as they happen
+    TERMINAL_STATUSES = ("Filled", "Cancelled", "ApiCancelled", "Inactive")
+
+    def __init__(self, connection, event_queue: Queue, pacer, history_size=1000):
+        self.connection = connection
+        self.event_queue = event_queue
+        self.pacer = pacer
+        self.lock = threading.Lock()
+        self.open_orders = {}  # order_id -> order state
+        self.completed = deque(maxlen=history_size)
+
+    def submit_batch(self, batch, protective=False) -> list:
+        # batch: list of (contract, order) or (contract, [parent, child, ...]) for attached orders.
+        # ids are reserved up front, then the whole batch goes out in one pass, as fast as the
+        # pacer allows. returns one id per entry, or a list of ids for attached orders.
+        # protective=True marks standalone stop orders, attached children always are
+        flat = []
+        order_ids = []
+        with self.lock:
+            for contract, orders in batch:
+                group = orders if isinstance(orders, list) else [orders]
+                group_ids = []
+                for order in group:
+                    order_id = self.connection.next_order_id
+                    self.connection.next_order_id += 1
+                    if group_ids:
+                        order.parentId = group_ids[0]
+                    self._track(order_id, contract.symbol, order.action, order.totalQuantity, order.orderType,
+                                protective=protective or bool(group_ids))
+                    group_ids.append(order_id)
+                    flat.append((order_id, contract, order))
+                order_ids.append(group_ids if isinstance(orders, list) else group_ids[0])
+
+        for order_id, contract, order in flat:
+            self.pacer.acquire()
+            print(f"Placing Order {order_id}: {order.action} {order.totalQuantity} of {contract.symbol} ({order.orderType})")
+            self.open_orders[order_id]['submitted_at'] = time.monotonic()
+            self.connection.placeOrder(order_id, contract, order)
+            self.pacer.release()
+        return order_ids
+
+    def _track(self, order_id, symbol, action, quantity, order_type, protective=False):
+        # protective orders (attached stops) rest at the broker for the life of the position,
+        # so they don't count as in-flight
+        self.open_orders[order_id] = {
+            'order_id': order_id, 'symbol': symbol, 'action': action,
+            'quantity': float(quantity), 'order_type': order_type, 'protective': protective,
+            'status': "PendingSubmit", 'filled': 0.0, 'remaining': float(quantity),
+            'avg_fill_price': 0.0, 'submitted_at': None, 'acked_at': None, 'done_at': None
+        }
+
+    def track_existing(self, order_id, symbol, action, quantity, order_type="TRAIL"):
+        # re-attach a protective order left working at the broker by a previous session
+        with self.lock:
+            self._track(order_id, symbol, action, quantity, order_type, protective=True)
+            self.open_orders[order_id]['status'] = "PreSubmitted"
+
+    def forget(self, order_id):
+        # stop tracking an order the broker no longer has, e.g. a stop that expired while we were away
+        with self.lock:
+            self.open_orders.pop(order_id, None)
+
+    def on_order_status(self, order_id, status, filled, remaining, avg_fill_price):
+        with self.lock:
+            state = self.open_orders.get(order_id)
+            if state is None:
+                return
+            now = time.monotonic()
+            if state['acked_at'] is None:
+                state['acked_at'] = now
+            print(f"Order Status Update - ID: {order_id}, Symbol: {state['symbol']}, Status: {status}, "
+                  f"Filled: {filled}/{state['quantity']}")
+
+            filled = float(filled)
+            increment = filled - state['filled']
+            if increment > 0:
+                # IB reports the cumulative average, back out the price of this increment
+                increment_price = (avg_fill_price * filled - state['avg_fill_price'] * state['filled']) / increment
+                state['filled'] = filled
+                state['avg_fill_price'] = avg_fill_price
+                self.event_queue.put({'event_type': 'FILL', 'order_id': order_id, 'symbol': state['symbol'],
+                                      'action': state['action'], 'quantity': increment,
+                                      'fill_price': increment_price, 'cumulative_quantity': filled,
+                                      'remaining': float(remaining), 'partial': float(remaining) > 0})
+            state['remaining'] = float(remaining)
+            state['status'] = status
+
+            if status in self.TERMINAL_STATUSES:
+                state['done_at'] = now
+                self.completed.append(state)
+                del self.open_orders[order_id]
+
+    def has_open_order(self, symbol) -> bool:
+        with self.lock:
+            return any(state['symbol'] == symbol and not state['protective'] for state in self.open_orders.values())
+
+    def open_exposure(self) -> dict:
+        # signed quantity still waiting to be filled per symbol (buys positive, sells negative)
+        exposure = {}
+        with self.lock:
+            for state in self.open_orders.values():
+                if state['protective']:
+                    continue
+                sign = 1 if state['action'].upper() == "BUY" else -1
+                exposure[state['symbol']] = exposure.get(state['symbol'], 0.0) + sign * state['remaining']
+        return exposure
+
+    def latency_stats(self) -> dict:
+        with self.lock:
+            done = [s for s in self.completed if s['submitted_at'] is not None and not s['protective']]
+        ack = [(s['acked_at'] - s['submitted_at']) * 1000 for s in done if s['acked_at'] is not None]
+        fill = [(s['done_at'] - s['submitted_at']) * 1000 for s in done if s['status'] == "Filled"]
+        return {
+            'orders': len(done),
+            'mean_ack_ms': sum(ack) / len(ack) if ack else None,
+            'max_ack_ms': max(ack) if ack else None,
+            'mean_fill_ms': sum(fill) / len(fill) if fill else None,
+            'max_fill_ms': max(fill) if fill else None,
+        }
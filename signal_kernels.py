@@ -0,0 +1,258 @@
+import numpy as np
+from enum import IntEnum
+
+try:
+    from numba import njit
+except ImportError:  # no numba: the kernels run as plain Python over the same arrays
+    def njit(*args, **kwargs):
+        if args and callable(args[0]):
+            return args[0]
+        return lambda function: function
+
+
+# integer encodings of the strings returned by mean_momentum_strategy's signal methods
+class MacdState(IntEnum):
+    WEAK = 0     # "weak"
+    MEDIUM = 1   # "Medium"
+    STRONG = 2   # "strong"
+
+
+class BandState(IntEnum):
+    SMA = 0        # "SMA"
+    UP_ABOVE = 1   # "up above"
+    LOW_BELOW = 2  # "low below"
+
+
+class AtrState(IntEnum):
+    LOW = 0   # "low"
+    HIGH = 1  # "high"
+
+
+class SellReason(IntEnum):
+    HOLD = 0
+    STOP_LOSS = 1
+    MOMENTUM_FADING = 2
+    PROFIT_TARGET = 3
+    TIME_STOP = 4
+
+
+MODES = {"both": 0, "momentum": 1, "mean_reversion": 2}
+
+# plain ints so numba folds them as constants
+_WEAK, _MEDIUM, _STRONG = 0, 1, 2
+_SMA, _UP_ABOVE, _LOW_BELOW = 0, 1, 2
+_LOW, _HIGH = 0, 1
+_HOLD, _STOP_LOSS, _MOMENTUM_FADING, _PROFIT_TARGET, _TIME_STOP = 0, 1, 2, 3, 4
+_MOMENTUM_ONLY, _MEAN_REVERSION_ONLY = 1, 2
+
+
+@njit(cache=True)
+def macd_states(macd_last, macd_prev, signal_last, signal_prev, count):
+    out = np.zeros(macd_last.shape[0], dtype=np.int8)
+    for i in range(macd_last.shape[0]):
+        if count[i] < 2:
+            continue
+        if macd_last[i] >= signal_last[i] and macd_prev[i] <= signal_prev[i]:
+            out[i] = _STRONG
+        elif macd_last[i] >= signal_last[i] and macd_prev[i] >= signal_prev[i]:
+            out[i] = _MEDIUM
+    return out
+
+
+@njit(cache=True)
+def band_states(price, upper, lower, count):
+    out = np.zeros(price.shape[0], dtype=np.int8)
+    for i in range(price.shape[0]):
+        if count[i] < 1:
+            continue
+        if price[i] >= upper[i]:
+            out[i] = _UP_ABOVE
+        elif price[i] <= lower[i]:
+            out[i] = _LOW_BELOW
+    return out
+
+
+@njit(cache=True)
+def atr_states(atr_last, atr_sma, count):
+    out = np.zeros(atr_last.shape[0], dtype=np.int8)
+    for i in range(atr_last.shape[0]):
+        if count[i] >= 31 and atr_last[i] > atr_sma[i] * 1.5:
+            out[i] = _HIGH
+    return out
+
+
+@njit(cache=True)
+def buy_signals(bullish, mode, has_data, macd_state, band_state, atr_state, rsi_last):
+    out = np.zeros(macd_state.shape[0], dtype=np.bool_)
+    for i in range(macd_state.shape[0]):
+        if not has_data[i]:
+            continue
+        if bullish:
+            # the reference compares against "medium" while MACD_signal returns "Medium",
+            # so in practice only a fresh crossover buys. kept as is for parity
+            if mode != _MEAN_REVERSION_ONLY and atr_state[i] == _HIGH and macd_state[i] == _STRONG:
+                out[i] = True
+        else:
+            if mode != _MOMENTUM_ONLY and band_state[i] == _LOW_BELOW and rsi_last[i] < 40:
+                out[i] = True
+    return out
+
+
+@njit(cache=True)
+def sell_signals(bullish, price, stop_loss_price, macd_state, rsi_last, sma_last, sma_count, days_held):
+    # stop_loss_price is NaN for positions without a stop in the polling loop
+    out = np.zeros(price.shape[0], dtype=np.int8)
+    for i in range(price.shape[0]):
+        if price[i] <= stop_loss_price[i]:
+            out[i] = _STOP_LOSS
+        elif bullish:
+            if macd_state[i] == _WEAK and rsi_last[i] <= 70:
+                out[i] = _MOMENTUM_FADING
+        else:
+            if sma_count[i] > 0 and price[i] >= sma_last[i]:
+                out[i] = _PROFIT_TARGET
+            elif days_held[i] >= 20:
+                out[i] = _TIME_STOP
+    return out
+
+
+def _zscore(values, eligible):
+    # standardized against the eligible entries only
+    sample = values[eligible & ~np.isnan(values)]
+    mean = sample.mean() if sample.size else 0.0
+    std = sample.std() if sample.size else 0.0
+    return (values - mean) / std if std > 0 else np.zeros_like(values)
+
+
+def rank_scores(bullish, price, rsi_last, upper, lower, hist_last, atr_last, atr_sma, eligible=None):
+    # cross-sectional score, higher is better. in a bull regime it rewards momentum (MACD
+    # histogram relative to price, ATR expansion, RSI), otherwise depth of the pullback
+    # (distance below the Bollinger band, low RSI). each term is z-scored across the eligible
+    # candidates (all of them when eligible is None), so names that can't be bought don't
+    # shift the ranking
+    eligible = np.ones(price.shape[0], dtype=np.bool_) if eligible is None else np.asarray(eligible, dtype=np.bool_)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        if bullish:
+            score = (_zscore(hist_last / price, eligible) + _zscore(atr_last / atr_sma - 1, eligible)
+                     + _zscore(rsi_last, eligible))
+        else:
+            score = -_zscore((price - lower) / (upper - lower), eligible) - _zscore(rsi_last, eligible)
+    return np.where(np.isnan(score), -np.inf, score)
+
+
+def top_k(scores, eligible, k):
+    # indices of the k best eligible scores, best first. argpartition keeps it O(n) before the
+    # final sort of just k elements
+    candidates = np.flatnonzero(eligible)
+    if k <= 0:
+        return candidates[:0]
+    if candidates.size > k:
+        candidates = candidates[np.argpartition(-scores[candidates], k - 1)[:k]]
+    return candidates[np.argsort(-scores[candidates], kind='stable')]
+
+
+def parity_check(strategy, prices: dict, positions: dict = None) -> list:
+    # compares the kernels against the string based reference for every ticker in prices.
+    # positions: {ticker: (position_data, days_held)}. returns a list of mismatches
+    tickers = list(prices)
+    price_array = np.array([prices[ticker] for ticker in tickers], dtype=np.float64)
+    inputs = strategy.signal_inputs(tickers)
+    mismatches = []
+
+    macd = macd_states(inputs['macd_last'], inputs['macd_prev'], inputs['signal_last'], inputs['signal_prev'],
+                       inputs['macd_count'])
+    bands = band_states(price_array, inputs['upper'], inputs['lower'], inputs['band_count'])
+    atr = atr_states(inputs['atr_last'], inputs['atr_sma'], inputs['atr_count'])
+    names = {
+        'macd': ({"weak": MacdState.WEAK, "Medium": MacdState.MEDIUM, "strong": MacdState.STRONG}, macd),
+        'bands': ({"SMA": BandState.SMA, "up above": BandState.UP_ABOVE, "low below": BandState.LOW_BELOW}, bands),
+        'atr': ({"low": AtrState.LOW, "high": AtrState.HIGH}, atr),
+    }
+    for i, ticker in enumerate(tickers):
+        reference = {'macd': strategy.MACD_signal(ticker), 'bands': strategy.boilinger_signal(prices[ticker], ticker),
+                     'atr': strategy.atr_signal(ticker)}
+        for name, (encoding, states) in names.items():
+            if encoding[reference[name]] != states[i]:
+                mismatches.append((ticker, name, reference[name], int(states[i])))
+
+    buys = strategy.get_buy_signals(tickers, price_array)
+    for i, ticker in enumerate(tickers):
+        if strategy.has_data(ticker) and strategy.get_buy_signal(ticker, prices[ticker]) != bool(buys[i]):
+            mismatches.append((ticker, 'buy', not buys[i], bool(buys[i])))
+
+    if positions:
+        held = list(positions)
+        sells = strategy.get_sell_signals(held, np.array([prices[ticker] for ticker in held]),
+                                          [positions[ticker][0] for ticker in held],
+                                          np.array([positions[ticker][1] for ticker in held]))
+        for i, ticker in enumerate(held):
+            position_data, days_held = positions[ticker]
+            reference = strategy.get_sell_signal(ticker, prices[ticker], position_data, days_held)
+            if reference != (sells[i] != SellReason.HOLD):
+                mismatches.append((ticker, 'sell', reference, int(sells[i])))
+    return mismatches
+
+
+def random_walk_frames(tickers, n_days=420, seed=7, regime="mixed") -> dict:
+    # OHLCV random walks for tickers and ^NDX.
+    # "mixed": a bear stretch keeps ^NDX under its 200 day SMA, exercising the mean reversion rules.
+    # "bull": ^NDX trends up, and every ticker has recurring pullbacks followed by a sharp rebound on a
+    # blown-out range, i.e. a fresh MACD crossover during an ATR expansion, so momentum buys happen
+    import pandas as pd
+
+    rng = np.random.default_rng(seed)
+    index = pd.bdate_range("2020-01-01", periods=n_days)
+    frames = {}
+    for ticker in list(tickers) + ['^NDX']:
+        if regime == "bull":
+            if ticker == '^NDX':
+                returns = rng.normal(0.0015, 0.008, n_days)
+                spread = np.full(n_days, 0.01)
+            else:
+                returns = rng.normal(0.0005, 0.01, n_days)
+                spread = rng.uniform(0.002, 0.012, n_days)
+                for start in range(int(rng.integers(60, 95)), n_days - 20, int(rng.integers(30, 45))):
+                    returns[start:start + 12] -= 0.012
+                    returns[start + 12:start + 17] += 0.03
+                    spread[start + 12:start + 17] = rng.uniform(0.05, 0.08, 5)
+            close = 100 * np.exp(np.cumsum(returns))
+            high, low = close * (1 + spread), close * (1 - spread)
+        else:
+            returns = rng.normal(0.0005, 0.02, n_days)
+            returns[150:230] -= 0.006
+            close = 100 * np.exp(np.cumsum(returns))
+            high, low = close * (1 + rng.uniform(0, 0.03, n_days)), close * (1 - rng.uniform(0, 0.03, n_days))
+        frames[ticker] = pd.DataFrame({'Open': close, 'High': high, 'Low': low, 'Close': close, 'Volume': 1e6},
+                                      index=index)
+    return frames
+
+
+if __name__ == '__main__':
+    # parity run on random walks with bull and bear stretches, every mode, several cut-off days
+    from indicator_store import IndicatorStore
+    from strategy_mean_momentum import mean_momentum_strategy
+
+    rng = np.random.default_rng(7)
+    n_days, tickers = 420, [f"T{i:03d}" for i in range(60)]
+    for regime in ("mixed", "bull"):
+        frames = random_walk_frames(tickers, n_days, regime=regime)
+        index = frames['^NDX'].index
+        store = IndicatorStore({ticker: frames[ticker] for ticker in tickers}, frames['^NDX'])
+        checked, buys, failures = 0, 0, []
+        for mode in MODES:
+            strategy = mean_momentum_strategy(tickers=tickers, mode=mode)
+            strategy.use_indicators(store)
+            for cut in range(20, n_days, 7):
+                store.set_date(index[cut])
+                prices = {ticker: frames[ticker]['Close'].iloc[cut] * rng.uniform(0.9, 1.1) for ticker in tickers}
+                positions = {}
+                for ticker in tickers[::3]:
+                    stop = prices[ticker] * rng.uniform(0.85, 1.05)
+                    position_data = {'stop_loss_price': stop} if rng.random() < 0.7 else {}
+                    positions[ticker] = (position_data, int(rng.integers(0, 40)))
+                failures += parity_check(strategy, prices, positions)
+                buys += int(strategy.get_buy_signals(tickers, list(prices.values())).sum())
+                checked += len(tickers)
+        print(f"{regime}: checked {checked} ticker-days ({buys} buy signals), {len(failures)} mismatches")
+        for failure in failures[:20]:
+            print(failure)
@@ -0,0 +1,155 @@
+import sqlite3
+import threading
+import time
+from queue import Queue, Empty
+from datetime import datetime
+
+
+class StateStore:
+    # local SQLite journal for the live bot. all writes go through a queue and are
+    # committed in batches by one background thread, so the trading loop never waits on disk
+    SCHEMA = [
+        """CREATE TABLE IF NOT EXISTS orders (
+            order_id INTEGER, symbol TEXT, action TEXT, quantity REAL, order_type TEXT, ts TEXT)""",
+        """CREATE TABLE IF NOT EXISTS fills (
+            order_id INTEGER, symbol TEXT, action TEXT, quantity REAL, fill_price REAL, ts TEXT)""",
+        """CREATE TABLE IF NOT EXISTS stop_updates (
+            symbol TEXT, stop_loss_price REAL, ts TEXT)""",
+        """CREATE TABLE IF NOT EXISTS pnl_snapshots (
+            daily_pnl REAL, unrealized_pnl REAL, realized_pnl REAL, cash_balance REAL, ts TEXT)""",
+        """CREATE TABLE IF NOT EXISTS positions (
+            symbol TEXT PRIMARY KEY, quantity REAL, average_cost REAL, buy_date TEXT,
+            stop_loss_price REAL, strategy_type TEXT, stop_order_id INTEGER)""",
+    ]
+
+    def __init__(self, path="bot_state.db", batch_size=200, flush_interval=0.25):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.write_queue = Queue()
+        self._stop = threading.Event()
+
+        conn = self._open()
+        for statement in self.SCHEMA:
+            conn.execute(statement)
+        columns = [row[1] for row in conn.execute("PRAGMA table_info(positions)")]
+        if 'stop_order_id' not in columns:  # databases written before broker-side stops
+            conn.execute("ALTER TABLE positions ADD COLUMN stop_order_id INTEGER")
+        conn.commit()
+        conn.close()
+
+        self.writer_thread = threading.Thread(target=self._writer_loop, daemon=True)
+        self.writer_thread.start()
+
+    def _open(self):
+        conn = sqlite3.connect(self.path)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def _writer_loop(self):
+        conn = self._open()  # sqlite connections stay on the thread that made them
+        while not self._stop.is_set() or not self.write_queue.empty():
+            try:
+                batch = [self.write_queue.get(timeout=self.flush_interval)]
+            except Empty:
+                continue
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.write_queue.get_nowait())
+                except Empty:
+                    break
+            try:
+                self._write_batch(conn, batch)
+            except sqlite3.Error:
+                conn.rollback()
+                self._write_rows(conn, batch)
+            for _ in batch:
+                self.write_queue.task_done()
+        conn.close()
+
+    def _write_batch(self, conn, batch):
+        # consecutive writes with the same statement go through one executemany, order is kept
+        i = 0
+        while i < len(batch):
+            sql = batch[i][0]
+            j = i
+            while j < len(batch) and batch[j][0] == sql:
+                j += 1
+            conn.executemany(sql, [params for _, params in batch[i:j]])
+            i = j
+        conn.commit()
+
+    def _write_rows(self, conn, batch):
+        # fallback after a failed batch: one statement at a time, so a bad row only loses itself
+        dropped = 0
+        for sql, params in batch:
+            try:
+                conn.execute(sql, params)
+            except sqlite3.Error as e:
+                dropped += 1
+                print(f"STATE STORE ERROR: {e} (dropped {sql.split('(')[0].strip()} {params})")
+        try:
+            conn.commit()
+        except sqlite3.Error as e:
+            conn.rollback()
+            print(f"STATE STORE ERROR: {e} (dropped {len(batch) - dropped} writes)")
+
+    def _put(self, sql, params):
+        self.write_queue.put((sql, params))
+
+    def record_order(self, order_id, symbol, action, quantity, order_type="MKT"):
+        self._put("INSERT INTO orders VALUES (?, ?, ?, ?, ?, ?)",
+                  (order_id, symbol, action, quantity, order_type, datetime.now().isoformat()))
+
+    def record_fill(self, order_id, symbol, action, quantity, fill_price):
+        self._put("INSERT INTO fills VALUES (?, ?, ?, ?, ?, ?)",
+                  (order_id, symbol, action, quantity, fill_price, datetime.now().isoformat()))
+
+    def record_stop(self, symbol, stop_loss_price):
+        self._put("INSERT INTO stop_updates VALUES (?, ?, ?)",
+                  (symbol, stop_loss_price, datetime.now().isoformat()))
+
+    def record_pnl(self, pnl_data: dict, cash_balance: float):
+        self._put("INSERT INTO pnl_snapshots VALUES (?, ?, ?, ?, ?)",
+                  (pnl_data['daily'], pnl_data['unrealized'], pnl_data['realized'], cash_balance,
+                   datetime.now().isoformat()))
+
+    def save_position(self, symbol, position: dict):
+        buy_date = position.get('buy_date')
+        self._put("INSERT OR REPLACE INTO positions VALUES (?, ?, ?, ?, ?, ?, ?)",
+                  (symbol, position.get('quantity'), position.get('average_cost'),
+                   buy_date.isoformat() if buy_date is not None else None,
+                   position.get('stop_loss_price'), position.get('strategy_type'), position.get('stop_order_id')))
+
+    def remove_position(self, symbol):
+        self._put("DELETE FROM positions WHERE symbol = ?", (symbol,))
+
+    def load_portfolio(self) -> dict:
+        start = time.perf_counter()
+        conn = self._open()
+        rows = conn.execute("SELECT symbol, quantity, average_cost, buy_date, stop_loss_price, strategy_type, "
+                            "stop_order_id FROM positions").fetchall()
+        conn.close()
+
+        portfolio = {}
+        for symbol, quantity, average_cost, buy_date, stop_loss_price, strategy_type, stop_order_id in rows:
+            position = {'quantity': quantity, 'average_cost': average_cost}
+            if buy_date is not None:
+                position['buy_date'] = datetime.fromisoformat(buy_date)
+            if stop_loss_price is not None:
+                position['stop_loss_price'] = stop_loss_price
+            if strategy_type is not None:
+                position['strategy_type'] = strategy_type
+            if stop_order_id is not None:
+                position['stop_order_id'] = stop_order_id
+            portfolio[symbol] = position
+        print(f"Restored {len(portfolio)} positions from {self.path} in {(time.perf_counter() - start) * 1000:.1f} ms")
+        return portfolio
+
+    def flush(self):
+        self.write_queue.join()
+
+    def close(self):
+        self._stop.set()
+        self.writer_thread.join()
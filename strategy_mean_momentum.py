@@ -1,77 +1,65 @@
 import yfinance as yf
-import pandas as pd
 from datetime import datetime, timedelta
-import talib as ta
+import numpy as np
+
+import signal_kernels
+from indicator_store import IndicatorStore
 
 
 class mean_momentum_strategy():
-    def __init__(self):
-        self.SMA = {}
-        self.upper_boilinger120 = {}
-        self.lower_boilinger120 = {}
-        self.volume120 = {}
-        self.MACD = {}
+    def __init__(self, tickers=None, mode="both"):
         self.tickers_data = {}
-        self.ATR = {}
-        self.RSI = {}
-        self.nasdaq100 = None
-        self.tickers = [
+        self.indicators = None  # IndicatorStore with the prices, indicators and NASDAQ 100 regime
+        self.mode = mode  # "both", "momentum" (bull regime only) or "mean_reversion" (bear regime only)
+        self.tickers = list(tickers) if tickers is not None else [
             "MSFT", "AAPL", "NVDA", "AMZN", "GOOGL", "GOOG", "META", "AVGO",
             "TSLA", "COST", "AMD", "PEP", "ADBE", "NFLX", "QCOM", "LIN",
             "INTC", "AMAT", "CMCSA", "INTU", "TXN", "AMGN", "CSCO", "LRCX",
             "HON", "BKNG", "ADP", "SBUX", "ISRG", "VRTX"
         ]
-    def historical_data(self):
-        end_date = datetime.now()
-        start_date = end_date - timedelta(days=365)
 
+    def use_indicators(self, store: IndicatorStore):
+        # several strategies (e.g. backtest sleeves) can read the same store
+        self.indicators = store
+
+    def historical_data(self, connection=None):
+        # warm-up from yfinance, or from IB when a connected Connection is passed in
         tickers_to_download = self.tickers + ['^NDX']
-        all_data = yf.download(tickers_to_download, start=start_date, end=end_date)
+        if connection is not None:
+            frames = connection.request_historical_bars(tickers_to_download, duration="1 Y")
+        else:
+            end_date = datetime.now()
+            start_date = end_date - timedelta(days=365)
+            all_data = yf.download(tickers_to_download, start=start_date, end=end_date)
+            frames = {ticker: all_data.xs(ticker, level=1, axis=1) for ticker in tickers_to_download
+                      if ('Close', ticker) in all_data.columns}
 
         for ticker in self.tickers:
-            if ('Close', ticker) in all_data.columns:
-                ticker_df = all_data.xs(ticker, level=1, axis=1).dropna()
+            if ticker in frames:
+                ticker_df = frames[ticker].dropna()
                 if not ticker_df.empty:
                     self.tickers_data[ticker] = ticker_df
-                    self.calculate_indicators(ticker, ticker_df)
             else:
                 print(f"Could not download data for {ticker}. Skipping.")
 
-        self.nasdaq100 = all_data.xs('^NDX', level=1, axis=1).dropna()
+        self.use_indicators(IndicatorStore(self.tickers_data, frames['^NDX'].dropna()))
         print("Setup complete.")
 
-    def calculate_indicators(self, ticker: str, data: pd.DataFrame):
-        self.SMA[ticker] = data['Close'].rolling(window=30).mean()
-
-        self.upper_boilinger120[ticker] = self.SMA[ticker] + 2 * data['Close'].rolling(30).std()
-        self.lower_boilinger120[ticker] = self.SMA[ticker] - 2 * data['Close'].rolling(30).std()
-        self.RSI[ticker] = pd.Series(ta.RSI(data['Close'].values, timeperiod=14), index=data.index)
-
-        high_prices = data['High'].values
-        low_prices = data['Low'].values
-        close_prices = data['Close'].values
-        atr = ta.ATR(high_prices, low_prices, close_prices, timeperiod=14)
-        self.ATR[ticker] = pd.Series(atr, index=data.index[-len(atr):])
-
-        macd, macdsignal, macdhist = ta.MACD(data['Close'].values, fastperiod=24, slowperiod=52, signalperiod=18)
-        self.MACD[ticker] = {
-            "macd_line": pd.Series(macd, index=data.index[-len(macd):]),
-            "signal_line": pd.Series(macdsignal, index=data.index[-len(macdsignal):]),
-            "hist": pd.Series(macdhist, index=data.index[-len(macdhist):])
-        }
+    def has_data(self, ticker: str) -> bool:
+        return self.indicators.history('Close', ticker).shape[0] > 0
 
     def MACD_signal(self, ticker: str) -> str:
-        if ticker not in self.MACD or self.MACD[ticker]["macd_line"].shape[0] < 2:
+        macd_line = self.indicators.history('macd_line', ticker)
+        if macd_line.shape[0] < 2:
             return "weak"
 
-        macd_line = self.MACD[ticker]["macd_line"]
-        signal_line = self.MACD[ticker]["signal_line"]
+        signal_line = self.indicators.history('signal_line', ticker)
 
-        last_macd = macd_line.iloc[-1]
-        before_last_macd = macd_line.iloc[-2]
+        last_macd = macd_line[-1]
+        before_last_macd = macd_line[-2]
 
-        last_signal = signal_line.iloc[-1]
-        before_last_signal = signal_line.iloc[-2]
+        last_signal = signal_line[-1]
+        before_last_signal = signal_line[-2]
 
         if last_macd >= last_signal and before_last_macd <= before_last_signal:
             return "strong"
@@ -81,25 +69,26 @@ class mean_momentum_strategy():
         return "weak"
 
     def boilinger_signal(self, current_price: int, ticker: str) -> str:
-        if ticker not in self.upper_boilinger120 or self.upper_boilinger120[ticker].empty:
+        upper_band = self.indicators.history('upper_band', ticker)
+        if upper_band.shape[0] == 0:
             return "SMA"
 
-        upper_band = self.upper_boilinger120[ticker].iloc[-1]
-        lower_band = self.lower_boilinger120[ticker].iloc[-1]
+        lower_band = self.indicators.history('lower_band', ticker)
 
-        if current_price >= upper_band:
+        if current_price >= upper_band[-1]:
             return "up above"
-        if current_price <= lower_band:
+        if current_price <= lower_band[-1]:
             return "low below"
 
         return "SMA"
 
     def atr_signal(self, ticker: str) -> str:
-        if ticker not in self.ATR or self.ATR[ticker].shape[0] < 31:
+        atr = self.indicators.history('ATR', ticker)
+        if atr.shape[0] < 31:
             return "low"  # Not enough data
 
-        last_atr = self.ATR[ticker].iloc[-1]
-        atr_sma = self.ATR[ticker].rolling(window=30).mean().iloc[-1]
+        last_atr = atr[-1]
+        atr_sma = self.indicators.history('ATR_SMA', ticker)[-1]
 
         if last_atr > (atr_sma * 1.5):
             return "high"
@@ -107,21 +96,21 @@ class mean_momentum_strategy():
         return "low"
 
     def is_bullish(self) -> bool:
-        sma_200 = self.nasdaq100['Close'].rolling(window=200).mean()
-        last_close = self.nasdaq100['Close'].iloc[-1]
-        last_sma = sma_200.iloc[-1]
-        return last_close > last_sma
+        # NASDAQ 100 close above its 200 day SMA
+        return self.indicators.is_bullish()
 
     def get_buy_signal(self, ticker: str, current_price: int) -> bool:
-        if ticker not in self.tickers_data:
+        if not self.has_data(ticker):
             return False
         atr_signal = self.atr_signal(ticker)
         bullish = self.is_bullish()
         macd_signal = self.MACD_signal(ticker)
         boilinger_signal = self.boilinger_signal(current_price, ticker)
-        last_rsi = self.RSI[ticker].iloc[-1]
+        last_rsi = self.indicators.history('RSI', ticker)[-1]
 
         if bullish:
+            if self.mode == "mean_reversion":
+                return False
             # if atr_signal == "high" and (macd_signal == "strong" or macd_signal == "medium") and (
                     # boilinger_signal == "up above"):
                 # return True
@@ -129,6 +118,8 @@ class mean_momentum_strategy():
             if atr_signal == "high" and (macd_signal == "strong" or macd_signal == "medium"):
                 return True
         else:
+            if self.mode == "momentum":
+                return False
             if boilinger_signal == "low below" and last_rsi < 40:
                 return True
 
@@ -137,19 +128,22 @@ class mean_momentum_strategy():
         return False
 
     def get_sell_signal(self, ticker: str, current_price: float, position_data: dict, days_held: int) -> bool:
-        if current_price <= position_data.get('stop_loss_price', current_price + 1):
+        # positions without a local stop (broker-side stop, or loaded from IB) skip this check
+        stop_loss_price = position_data.get('stop_loss_price')
+        if stop_loss_price is not None and current_price <= stop_loss_price:
             print(f"SELL SIGNAL (Stop Loss Hit) for {ticker}")
             return True
         is_bull_market = self.is_bullish()
 
         if is_bull_market:
             macd_signal = self.MACD_signal(ticker)
-            if macd_signal == "weak" and self.RSI[ticker].iloc[-1] <= 70:
+            if macd_signal == "weak" and self.indicators.history('RSI', ticker)[-1] <= 70:
                 print(f"SELL SIGNAL (Momentum Fading) for {ticker}")
                 return True
         else:
-            if ticker in self.SMA and not self.SMA[ticker].empty:
-                profit_target = self.SMA[ticker].iloc[-1]
+            sma = self.indicators.history('SMA', ticker)
+            if sma.shape[0] > 0:
+                profit_target = sma[-1]
                 if current_price >= profit_target:
                     print(f"SELL SIGNAL (Mean Reversion Profit Target Hit) for {ticker}")
                     return True
@@ -158,3 +152,70 @@ class mean_momentum_strategy():
                 print(f"SELL SIGNAL (Time Stop) for {ticker}")
                 return True
         return False
+
+    def signal_inputs(self, tickers, columns=None) -> dict:
+        # last values of every indicator the rules look at, one array slot per ticker, gathered
+        # from the store's rows in one pass. counts stand in for the reference's "too short" checks
+        columns, last, prev, counts = self.indicators.positions(tickers, columns)
+        store = self.indicators
+        inputs = {
+            'macd_last': store.take('macd_line', last, columns, counts >= 2),
+            'macd_prev': store.take('macd_line', prev, columns, counts >= 2),
+            'signal_last': store.take('signal_line', last, columns, counts >= 2),
+            'signal_prev': store.take('signal_line', prev, columns, counts >= 2),
+            'hist_last': store.take('hist', last, columns, counts >= 2),
+            'upper': store.take('upper_band', last, columns, counts > 0),
+            'lower': store.take('lower_band', last, columns, counts > 0),
+            'atr_last': store.take('ATR', last, columns, counts >= 31),
+            'atr_sma': store.take('ATR_SMA', last, columns, counts >= 31),
+            'rsi_last': store.take('RSI', last, columns, counts > 0),
+            'sma_last': store.take('SMA', last, columns, counts > 0),
+            'has_data': counts > 0,
+        }
+        for name in ('macd_count', 'band_count', 'atr_count', 'sma_count'):
+            inputs[name] = counts
+        return inputs
+
+    def _signal_states(self, inputs, prices):
+        macd_state = signal_kernels.macd_states(inputs['macd_last'], inputs['macd_prev'], inputs['signal_last'],
+                                                inputs['signal_prev'], inputs['macd_count'])
+        band_state = signal_kernels.band_states(prices, inputs['upper'], inputs['lower'], inputs['band_count'])
+        atr_state = signal_kernels.atr_states(inputs['atr_last'], inputs['atr_sma'], inputs['atr_count'])
+        return macd_state, band_state, atr_state
+
+    def get_buy_signals(self, tickers, prices, bullish=None) -> np.ndarray:
+        # get_buy_signal for a whole list of tickers in one kernel call
+        if bullish is None:
+            bullish = self.is_bullish()
+        prices = np.asarray(prices, dtype=np.float64)
+        inputs = self.signal_inputs(tickers)
+        macd_state, band_state, atr_state = self._signal_states(inputs, prices)
+        return signal_kernels.buy_signals(bool(bullish), signal_kernels.MODES[self.mode],
+                                          inputs['has_data'], macd_state, band_state, atr_state, inputs['rsi_last'])
+
+    def get_sell_signals(self, tickers, prices, positions_data, days_held, bullish=None) -> np.ndarray:
+        # get_sell_signal for a list of held tickers, returns a signal_kernels.SellReason code per ticker
+        if bullish is None:
+            bullish = self.is_bullish()
+        prices = np.asarray(prices, dtype=np.float64)
+        stops = np.array([position.get('stop_loss_price', np.nan) for position in positions_data], dtype=np.float64)
+        inputs = self.signal_inputs(tickers)
+        macd_state, _, _ = self._signal_states(inputs, prices)
+        return signal_kernels.sell_signals(bool(bullish), prices, stops, macd_state, inputs['rsi_last'],
+                                           inputs['sma_last'], inputs['sma_count'],
+                                           np.asarray(days_held, dtype=np.int64))
+
+    def rank_buy_candidates(self, tickers, prices, k, bullish=None, columns=None) -> list:
+        # the (at most) k tickers with a buy signal that score best against each other, best first.
+        # columns: the tickers' store columns when the caller already has them
+        if bullish is None:
+            bullish = self.is_bullish()
+        prices = np.asarray(prices, dtype=np.float64)
+        inputs = self.signal_inputs(tickers, columns)
+        macd_state, band_state, atr_state = self._signal_states(inputs, prices)
+        buys = signal_kernels.buy_signals(bool(bullish), signal_kernels.MODES[self.mode], inputs['has_data'],
+                                          macd_state, band_state, atr_state, inputs['rsi_last'])
+        scores = signal_kernels.rank_scores(bool(bullish), prices, inputs['rsi_last'], inputs['upper'],
+                                            inputs['lower'], inputs['hist_last'], inputs['atr_last'],
+                                            inputs['atr_sma'], eligible=buys)
+        return [tickers[i] for i in signal_kernels.top_k(scores, buys, k)]
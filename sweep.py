@@ -0,0 +1,293 @@
+import argparse
+import itertools
+import json
+import multiprocessing
+import os
+import socket
+import threading
+import time
+import traceback
+import uuid
+
+import numpy as np
+import pandas as pd
+
+# parameter sweeps over a shared directory (e.g. an NFS mount), no scheduler needed:
+#   <root>/shards/shard_00000.json   list of tasks, written once by plan_sweep
+#   <root>/locks/shard_00000.lock    claim, created with O_EXCL and kept fresh by a heartbeat
+#   <root>/results/shard_00000.npz   one numpy array per result column, its presence marks the shard done
+# a lock whose heartbeat is older than lease_timeout belongs to a dead worker and is reclaimed.
+# a task that raises is recorded in the shard's 'error' column, the shard still counts as done
+
+STRATEGY_PARAMS = ('mode',)
+BACKTESTER_PARAMS = ('initial_capital', 'commission', 'trail_percentage', 'passive_weight', 'stop_mode',
+                     'fast_signals', 'selection', 'top_k', 'indicator_dtype')
+
+
+def _write_atomic(path, write):
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    with open(tmp_path, 'wb') as f:
+        write(f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def plan_sweep(root, param_grid: dict, universes: dict, date_ranges: list, shard_size=8) -> int:
+    # param_grid: {name: [values]}, universes: {name: [tickers]}, date_ranges: [(start, end)].
+    # tasks sharing a universe and date range land in the same shards so a worker downloads once
+    for sub_dir in ('shards', 'locks', 'results'):
+        os.makedirs(os.path.join(root, sub_dir), exist_ok=True)
+    names = list(param_grid)
+    tasks = []
+    for (universe, tickers), (start_date, end_date) in itertools.product(universes.items(), date_ranges):
+        for values in itertools.product(*(param_grid[name] for name in names)):
+            tasks.append({'task_id': len(tasks), 'universe': universe, 'tickers': list(tickers),
+                          'start_date': str(start_date), 'end_date': str(end_date),
+                          'params': dict(zip(names, values))})
+
+    shard_count = 0
+    for i in range(0, len(tasks), shard_size):
+        path = os.path.join(root, 'shards', f"shard_{shard_count:05d}.json")
+        _write_atomic(path, lambda f, shard=tasks[i:i + shard_size]: f.write(json.dumps(shard).encode()))
+        shard_count += 1
+    print(f"Planned {len(tasks)} tasks in {shard_count} shards under {root}")
+    return shard_count
+
+
+class ShardLock:
+    def __init__(self, root, shard, worker_id, lease_timeout):
+        self.path = os.path.join(root, 'locks', f"{shard}.lock")
+        self.token = f"{worker_id} {uuid.uuid4().hex}"
+        self.lease_timeout = lease_timeout
+        self._stop = threading.Event()
+        self._heartbeat = None
+
+    def acquire(self) -> bool:
+        try:
+            fd = os.open(self.path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            if not self._reclaim_stale():
+                return False
+            try:
+                fd = os.open(self.path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                return False
+        os.write(fd, self.token.encode())
+        os.close(fd)
+        self._heartbeat = threading.Thread(target=self._beat, daemon=True)
+        self._heartbeat.start()
+        return True
+
+    def _reclaim_stale(self) -> bool:
+        try:
+            age = time.time() - os.stat(self.path).st_mtime
+        except FileNotFoundError:
+            return True
+        if age < self.lease_timeout:
+            return False
+        # renaming is atomic, so only one of several reclaiming workers wins
+        stale = f"{self.path}.stale.{uuid.uuid4().hex}"
+        try:
+            os.rename(self.path, stale)
+        except FileNotFoundError:
+            return False
+        os.remove(stale)
+        print(f"Reclaimed {os.path.basename(self.path)} (no heartbeat for {age:.0f}s)")
+        return True
+
+    def _beat(self):
+        while not self._stop.wait(self.lease_timeout / 4):
+            try:
+                os.utime(self.path)
+            except FileNotFoundError:
+                return
+
+    def release(self):
+        self._stop.set()
+        # move the lock aside before reading it, so a lock another worker reclaimed from us in the
+        # meantime is never deleted, only put back
+        private_path = f"{self.path}.release.{uuid.uuid4().hex}"
+        try:
+            os.rename(self.path, private_path)
+        except FileNotFoundError:
+            return
+        with open(private_path) as f:
+            still_ours = f.read() == self.token
+        if not still_ours:
+            try:
+                os.link(private_path, self.path)
+            except FileExistsError:  # a newer lock already took its place
+                pass
+        os.remove(private_path)
+
+
+def run_backtest_task(task, data_cache: dict) -> dict:
+    # runs one sweep task through Backtester. data_cache keeps the last universe/date range's
+    # downloaded data and indicator stores, so consecutive tasks of a shard don't download or
+    # compute them again
+    from backtesting import Backtester
+    from strategy_mean_momentum import mean_momentum_strategy
+
+    params = task['params']
+    strategy = mean_momentum_strategy(tickers=task['tickers'],
+                                      **{k: v for k, v in params.items() if k in STRATEGY_PARAMS})
+    early_stop = None
+    if params.get('max_drawdown_limit') is not None:
+        limit = params['max_drawdown_limit']
+        early_stop = lambda metrics: metrics.max_drawdown < -limit
+    backtester = Backtester(strategy, task['start_date'], task['end_date'], quiet=True, early_stop=early_stop,
+                            **{k: v for k, v in params.items() if k in BACKTESTER_PARAMS})
+
+    data_key = (tuple(task['tickers']), task['start_date'], task['end_date'])
+    if data_cache.get('key') == data_key:
+        backtester.all_ticker_data = dict(data_cache['tickers'])
+        backtester.all_benchmark_data = dict(data_cache['benchmarks'])
+        backtester.indicators = data_cache['indicators'].get(str(np.dtype(backtester.indicator_dtype)))
+    else:
+        backtester._download_full_historical_data()
+        data_cache.update(key=data_key, tickers=dict(backtester.all_ticker_data),
+                          benchmarks=dict(backtester.all_benchmark_data), indicators={})
+    summary = backtester.run()
+    data_cache['indicators'][str(backtester.indicators.dtype)] = backtester.indicators
+    return summary
+
+
+def _column(values):
+    # plain dtypes only, so results load without pickle
+    if all(isinstance(value, (bool, np.bool_)) for value in values):
+        return np.array(values, dtype=bool)
+    if all(isinstance(value, (int, np.integer)) and not isinstance(value, bool) for value in values):
+        return np.array(values, dtype=np.int64)
+    if all(value is None or isinstance(value, (int, float, np.number)) for value in values):
+        return np.array([np.nan if value is None else value for value in values], dtype=np.float64)
+    return np.array([str(value) for value in values])
+
+
+def _shard_result_columns(tasks, results, errors) -> dict:
+    param_names = sorted({name for task in tasks for name in task['params']})
+    metric_names = sorted({name for result in results for name in result})
+    columns = {
+        'task_id': np.array([task['task_id'] for task in tasks]),
+        'universe': np.array([task['universe'] for task in tasks]),
+        'start_date': np.array([task['start_date'] for task in tasks]),
+        'end_date': np.array([task['end_date'] for task in tasks]),
+        'error': np.array(errors, dtype=str),  # empty for tasks that ran
+    }
+    for name in param_names:
+        columns[f"param_{name}"] = _column([task['params'].get(name) for task in tasks])
+    for name in metric_names:
+        columns[name] = _column([result.get(name) for result in results])
+    return columns
+
+
+def run_worker(root, worker_id=None, lease_timeout=300.0, task_fn=run_backtest_task, wait=False) -> int:
+    # claims shards until none are left. with wait=True it keeps polling while other workers
+    # hold shards, so it can take over if one of them dies
+    worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}"
+    data_cache = {}
+    processed = 0
+    while True:
+        pending = missing_shards(root)
+        if not pending:
+            break
+
+        claimed = False
+        for shard in pending:
+            lock = ShardLock(root, shard, worker_id, lease_timeout)
+            if not lock.acquire():
+                continue
+            claimed = True
+            try:
+                result_path = os.path.join(root, 'results', f"{shard}.npz")
+                if os.path.exists(result_path):  # finished between listing and claiming
+                    continue
+                with open(os.path.join(root, 'shards', f"{shard}.json")) as f:
+                    tasks = json.load(f)
+                started = time.time()
+                results, errors = [], []
+                for task in tasks:
+                    try:
+                        results.append(task_fn(task, data_cache))
+                        errors.append('')
+                    except Exception:
+                        error = traceback.format_exc()
+                        print(f"[{worker_id}] {shard}: task {task['task_id']} failed\n{error}")
+                        results.append({})
+                        errors.append(error)
+                columns = _shard_result_columns(tasks, results, errors)
+                _write_atomic(result_path, lambda out: np.savez(out, **columns))
+                processed += 1
+                failed = sum(1 for error in errors if error)
+                print(f"[{worker_id}] {shard}: {len(tasks)} tasks in {time.time() - started:.1f}s"
+                      + (f", {failed} failed" if failed else ""))
+            finally:
+                lock.release()
+
+        if not claimed:
+            if not wait:
+                break
+            time.sleep(min(lease_timeout / 4, 10.0))
+    return processed
+
+
+def missing_shards(root) -> list:
+    shards = sorted(name[:-5] for name in os.listdir(os.path.join(root, 'shards')) if name.endswith('.json'))
+    return [shard for shard in shards if not os.path.exists(os.path.join(root, 'results', f"{shard}.npz"))]
+
+
+def merge_results(root) -> pd.DataFrame:
+    results_dir = os.path.join(root, 'results')
+    frames = []
+    for name in sorted(os.listdir(results_dir)):
+        if name.endswith('.npz'):
+            with np.load(os.path.join(results_dir, name)) as data:
+                frames.append(pd.DataFrame({column: data[column] for column in data.files}))
+    if not frames:
+        return pd.DataFrame()
+    return pd.concat(frames, ignore_index=True).sort_values('task_id').reset_index(drop=True)
+
+
+def run_local(root, n_workers=4, lease_timeout=300.0, task_fn=run_backtest_task) -> pd.DataFrame:
+    # several worker processes on this host, exactly as they would run on separate nodes
+    workers = [multiprocessing.Process(target=run_worker, args=(root, f"local-{i}", lease_timeout, task_fn, True),
+                                       name=f"local-{i}") for i in range(n_workers)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+        if worker.exitcode != 0:
+            print(f"Worker {worker.name} exited with code {worker.exitcode}")
+    missing = missing_shards(root)
+    if missing:
+        print(f"{len(missing)} shards have no result: {', '.join(missing)}")
+    table = merge_results(root)
+    if 'error' in table and (table['error'] != '').any():
+        print(f"{int((table['error'] != '').sum())} of {len(table)} tasks failed, see the 'error' column")
+    return table
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Backtester parameter sweeps over a shared directory")
+    parser.add_argument('command', choices=['plan', 'work', 'merge', 'local'])
+    parser.add_argument('root')
+    parser.add_argument('--spec', help="plan: JSON file with param_grid, universes, date_ranges and shard_size")
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--lease-timeout', type=float, default=300.0)
+    parser.add_argument('--output', help="merge: write the merged table to this CSV file")
+    args = parser.parse_args()
+
+    if args.command == 'plan':
+        with open(args.spec) as f:
+            spec = json.load(f)
+        plan_sweep(args.root, spec['param_grid'], spec['universes'], spec['date_ranges'], spec.get('shard_size', 8))
+    elif args.command == 'work':
+        run_worker(args.root, lease_timeout=args.lease_timeout, wait=True)
+    elif args.command in ('merge', 'local'):
+        if args.command == 'local':
+            table = run_local(args.root, args.workers, args.lease_timeout)
+        else:
+            table = merge_results(args.root)
+        print(table.to_string())
+        if args.output:
+            table.to_csv(args.output, index=False)
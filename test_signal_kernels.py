@@ -0,0 +1,89 @@
+import numpy as np
+import pytest
+
+import signal_kernels
+from indicator_store import IndicatorStore
+from signal_kernels import SellReason
+from strategy_mean_momentum import mean_momentum_strategy
+
+TICKERS = [f"T{i:03d}" for i in range(40)]
+KERNELS = ('macd_states', 'band_states', 'atr_states', 'buy_signals', 'sell_signals')
+REGIMES = ("mixed", "bull")
+
+
+@pytest.fixture(scope="module")
+def universes():
+    # regime -> (frames, store). "mixed" stays bearish and covers the mean reversion rules,
+    # "bull" covers the momentum ones
+    universes = {}
+    for regime in REGIMES:
+        frames = signal_kernels.random_walk_frames(TICKERS, n_days=420, seed=7, regime=regime)
+        universes[regime] = frames, IndicatorStore({ticker: frames[ticker] for ticker in TICKERS}, frames['^NDX'])
+    return universes
+
+
+@pytest.fixture(params=["compiled", "python"])
+def kernels(request, monkeypatch):
+    # "python" swaps in the plain functions behind numba's njit (the same ones when numba is missing)
+    if request.param == "python":
+        for name in KERNELS:
+            kernel = getattr(signal_kernels, name)
+            monkeypatch.setattr(signal_kernels, name, getattr(kernel, 'py_func', kernel))
+    return request.param
+
+
+def _check_days(strategy, store, frames, positions_for, seed=11):
+    # parity on every seventh day. also counts what was compared, so a fixture that never
+    # triggers a rule can't pass silently
+    rng = np.random.default_rng(seed)
+    index = frames['^NDX'].index
+    mismatches = []
+    counts = {'bullish_days': 0, 'buys': 0, 'fading_sells': 0}
+    for cut in range(20, len(index), 7):
+        store.set_date(index[cut])
+        prices = {ticker: frames[ticker]['Close'].iloc[cut] * rng.uniform(0.9, 1.1) for ticker in TICKERS}
+        positions = positions_for(prices, rng)
+        mismatches += signal_kernels.parity_check(strategy, prices, positions)
+
+        counts['bullish_days'] += bool(strategy.is_bullish())
+        counts['buys'] += int(strategy.get_buy_signals(TICKERS, list(prices.values())).sum())
+        held = list(positions)
+        sells = strategy.get_sell_signals(held, [prices[ticker] for ticker in held],
+                                          [positions[ticker][0] for ticker in held],
+                                          [positions[ticker][1] for ticker in held])
+        counts['fading_sells'] += int((sells == SellReason.MOMENTUM_FADING).sum())
+    return mismatches, counts
+
+
+def _positions_with_stops(prices, rng):
+    return {ticker: ({'stop_loss_price': prices[ticker] * rng.uniform(0.85, 1.05)}, int(rng.integers(0, 40)))
+            for ticker in TICKERS[::3]}
+
+
+def _positions_without_stops(prices, rng):
+    # broker-side stops or positions loaded from IB carry no local stop
+    return {ticker: ({}, int(rng.integers(0, 40))) for ticker in TICKERS[1::3]}
+
+
+@pytest.mark.parametrize("mode", list(signal_kernels.MODES))
+@pytest.mark.parametrize("positions_for", [_positions_with_stops, _positions_without_stops])
+def test_kernels_match_reference(mode, positions_for, universes, kernels):
+    buys = 0
+    for regime, (frames, store) in universes.items():
+        strategy = mean_momentum_strategy(tickers=TICKERS, mode=mode)
+        strategy.use_indicators(store)
+        mismatches, counts = _check_days(strategy, store, frames, positions_for)
+        assert mismatches == [], regime
+        buys += counts['buys']
+    assert buys > 0  # the fixtures have to produce signals for the comparison to mean anything
+
+
+@pytest.mark.parametrize("positions_for", [_positions_with_stops, _positions_without_stops])
+def test_bull_fixture_exercises_momentum_rules(positions_for, universes):
+    frames, store = universes["bull"]
+    strategy = mean_momentum_strategy(tickers=TICKERS, mode="momentum")
+    strategy.use_indicators(store)
+    _, counts = _check_days(strategy, store, frames, positions_for)
+    assert counts['bullish_days'] > 0
+    assert counts['buys'] > 0
+    assert counts['fading_sells'] > 0